@@ -1,12 +1,40 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, make_response, g, has_request_context
+from markupsafe import Markup, escape
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.http import generate_etag, parse_cookie, parse_etags
+from itsdangerous import BadSignature
 from functools import wraps
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+import asyncio
+import atexit
+import base64
+import bisect
+import copy
+import hashlib
+import heapq
+import io
+import itertools
 import json
+import mmap
+import multiprocessing
 import os
 import math
 import re
-from collections import Counter
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from urllib.parse import parse_qs, quote
+import click
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this'
@@ -17,49 +45,1299 @@ POSTS_FILE = 'posts.json'
 COMMENTS_FILE = 'comments.json'
 CATEGORIES_FILE = 'categories.json'
 ANALYTICS_FILE = 'analytics.json'
+VIEWS_FILE = 'views.json'
+SIMILARITY_FILE = 'similarity.json'  # written by `flask --app app compute-similarity`
+
+# Storage backend: 'json' (the files above) or 'sqlite'. Run
+# `flask --app app migrate-json` once to import the JSON files into SQLite.
+STORAGE_BACKEND = os.environ.get('BLOG_STORAGE', 'json')
+SQLITE_DB = os.environ.get('BLOG_DB', 'blog.db')
+
+# On-disk format the data files are written in: 'json' (indented), 'compact'
+# (JSON without whitespace), 'jsonl' (a header line, then one record per
+# line) or 'binary' (records in a tagged struct encoding behind a table of
+# their offsets, read through mmap). Files are read in whatever format they
+# are in; convert the existing ones with `flask --app app convert-data FORMAT`.
+DATA_FORMATS = ('json', 'compact', 'jsonl', 'binary')
+DATA_FORMAT = os.environ.get('BLOG_DATA_FORMAT', 'compact')
 
 # Pagination settings
 POSTS_PER_PAGE = 6
 
+# Length of the plain-text excerpt stored with each post
+EXCERPT_LENGTH = 200
+
+# View tracking: views are queued and merged into views.json by the
+# background worker every VIEW_FLUSH_INTERVAL seconds or once
+# VIEW_FLUSH_THRESHOLD views are pending, whichever comes first
+VIEW_FLUSH_INTERVAL = 30
+VIEW_FLUSH_THRESHOLD = 100
+
+# Queue for view events and new comments, applied by a background worker
+# in batches of up to JOB_BATCH_SIZE jobs. Workers renew a lease at least
+# every VIEW_FLUSH_INTERVAL seconds; the jobs of a worker whose lease is
+# older than JOB_LEASE_SECONDS are taken over by another one.
+JOB_QUEUE_DB = os.environ.get('BLOG_QUEUE_DB', 'jobs.db')
+JOB_BATCH_SIZE = 500
+JOB_LEASE_SECONDS = 120
+
+# Trending: views over the last TRENDING_DAYS days. With TRENDING_DECAY < 1
+# each day's views count TRENDING_DECAY times less than the following day's.
+TRENDING_DAYS = 7
+TRENDING_DECAY = 1.0
+TRENDING_TOP_K = 100
+SIDEBAR_TRENDING = 5  # trending posts listed beside the /blog listing
+
+# View history retention: daily counts older than ANALYTICS_HOT_DAYS are
+# rolled up into weekly buckets, and weeks older than ANALYTICS_WEEKLY_DAYS
+# into monthly ones. The hot window must cover TRENDING_DAYS. With the JSON
+# files the totals and the hot window live in VIEWS_FILE, rewritten by every
+# flush, and the rolled-up buckets in ANALYTICS_FILE, only rewritten by the
+# rollup.
+ANALYTICS_HOT_DAYS = 30
+ANALYTICS_WEEKLY_DAYS = 182
+
+# Page cache for /blog and /post/<id>: entries expire after PAGE_CACHE_TTL
+# seconds and the least recently used are evicted beyond PAGE_CACHE_SIZE
+PAGE_CACHE_TTL = 60
+PAGE_CACHE_SIZE = 512
+
+# Cache-Control headers sent to browsers and the CDN. Post pages and API
+# responses also carry ETags, so 'no-cache' still allows cheap 304s.
+CACHE_CONTROL = {
+    'static': 'public, max-age=86400',
+    'post': 'private, no-cache',
+    'api': 'private, max-age=30',
+}
+
+# Users, posts and comments are stored as a snapshot file plus an
+# append-only change log next to it (posts.json.log). Every create, edit or
+# delete appends one line to the log instead of rewriting the snapshot; once
+# LOG_COMPACT_ENTRIES lines have piled up the log is folded back into the
+# snapshot, which is replaced atomically. Log appends are fsynced in groups:
+# a write waits for an fsync that covers it, and one fsync covers every
+# write appended before it started.
+CHANGE_LOG_FILES = (USERS_FILE, POSTS_FILE, COMMENTS_FILE)
+LOG_COMPACT_ENTRIES = 1000
+
+# Static export (`flask --app app export-static`): pages are written to
+# EXPORT_DIR by EXPORT_WORKERS processes
+EXPORT_DIR = 'export'
+EXPORT_WORKERS = 4
+
+# Parsed data files kept in memory between requests. Each entry remembers the
+# (mtime, size) of the files it was parsed from, so a write made by another
+# gunicorn worker is picked up on the next read; a log that only grew is
+# replayed from where the entry left off.
+_data_cache = {}
+_data_lock = threading.RLock()
+_data_versions = itertools.count(1)
+
+def _file_stamp(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _log_name(filename):
+    return filename + '.log'
+
+def _data_stamp(filename):
+    if filename in CHANGE_LOG_FILES:
+        return (_file_stamp(filename), _file_stamp(_log_name(filename)))
+    return _file_stamp(filename)
+
+def _copy_data(data):
+    """New list or dict holding the cached records. The records themselves
+    are shared with the cache: copy one (copy.deepcopy) before changing it."""
+    if isinstance(data, list):
+        return list(data)
+    if isinstance(data, dict):
+        return dict(data)
+    return data
+
+_held_locks = threading.local()
+
+@contextmanager
+def _file_lock(filename, shared=False):
+    """Hold a lock on the file shared by all worker processes (exclusive
+    unless `shared`). A thread already holding it can take it again."""
+    held = getattr(_held_locks, 'files', None)
+    if held is None:
+        held = _held_locks.files = Counter()
+    if held[filename]:
+        held[filename] += 1
+        try:
+            yield
+        finally:
+            held[filename] -= 1
+        return
+    with open(filename + '.lock', 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        held[filename] += 1
+        try:
+            yield
+        finally:
+            held[filename] -= 1
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+_JSONL_HEADER = 'blog-jsonl'
+# Binary files: a header, a table of each record's offset, then the records.
+# Values are a one-byte tag followed by struct-packed data: N/T/F (None and
+# the booleans), i (int64), d (float64), s (uint32 length, UTF-8), l (uint32
+# count, items), m (uint32 count, key/value pairs) and j (JSON text, for
+# integers beyond int64). Dict files store [key, value] records.
+_BINARY_MAGIC = b'BLOGBIN3'
+_BINARY_FRAMED = (b'BLOGBIN1', b'BLOGBIN2')  # earlier length-prefixed JSON records
+_BINARY_HEADER = struct.Struct('<8scI')  # magic, kind (L)ist or (D)ict, record count
+_BINARY_OFFSET = struct.Struct('<Q')
+_BINARY_SIZE = struct.Struct('<I')
+_BINARY_INT = struct.Struct('<q')
+_BINARY_FLOAT = struct.Struct('<d')
+
+# Post bodies in a binary posts file are not decoded when the file is read:
+# the cached record holds a _StoredText pointing into the mapped file, read
+# when a post page, search snippet or index build needs the body. Bodies
+# then sit in the OS page cache, shared by every worker, rather than in
+# each worker's heap. Files are only ever replaced, never rewritten in
+# place, so a mapping stays valid for the records still pointing into it.
+# Windows cannot replace a mapped file, so bodies are decoded there.
+_STORED_TEXT_FIELDS = {POSTS_FILE: ('content', 'content_html')} if os.name != 'nt' else {}
+
+class _StoredText:
+    """A string field of a binary file record, read from the mapping on use"""
+    __slots__ = ('mm', 'start', 'end')
+    
+    def __init__(self, mm, start, end):
+        self.mm, self.start, self.end = mm, start, end
+    
+    def __str__(self):
+        return str(self.mm[self.start:self.end], 'utf-8')
+
+def _read_stored_text(record):
+    """Copy of a cached record with its stored text fields read in"""
+    return {k: str(v) if isinstance(v, _StoredText) else v for k, v in record.items()}
+
+def _json_default(value):
+    if isinstance(value, _StoredText):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def _detect_format(f):
+    start = f.read(len(_BINARY_MAGIC))
+    f.seek(0)
+    if start == _BINARY_MAGIC or start in _BINARY_FRAMED:
+        return 'binary'
+    first_line = f.readline()
+    f.seek(0)
+    if first_line.startswith(b'{"format": "%s"' % _JSONL_HEADER.encode()):
+        return 'jsonl'
+    return 'json'
+
+def _encode_value(value, out):
+    """Append the binary encoding of a JSON value to the bytearray `out`"""
+    if value is None:
+        out += b'N'
+    elif value is True:
+        out += b'T'
+    elif value is False:
+        out += b'F'
+    elif isinstance(value, int) and -2 ** 63 <= value < 2 ** 63:
+        out += b'i' + _BINARY_INT.pack(value)
+    elif isinstance(value, float):
+        out += b'd' + _BINARY_FLOAT.pack(value)
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        out += b's' + _BINARY_SIZE.pack(len(data)) + data
+    elif isinstance(value, _StoredText):
+        data = value.mm[value.start:value.end]
+        out += b's' + _BINARY_SIZE.pack(len(data)) + data
+    elif isinstance(value, (list, tuple)):
+        out += b'l' + _BINARY_SIZE.pack(len(value))
+        for item in value:
+            _encode_value(item, out)
+    elif isinstance(value, dict):
+        out += b'm' + _BINARY_SIZE.pack(len(value))
+        for key, item in value.items():
+            _encode_value(str(key), out)
+            _encode_value(item, out)
+    else:
+        data = json.dumps(value).encode('utf-8')
+        out += b'j' + _BINARY_SIZE.pack(len(data)) + data
+
+def _decode_value(mm, pos, stored=()):
+    """The value encoded at `pos` and the position after it. String values of
+    the map keys in `stored` are left in `mm` as _StoredText."""
+    tag = mm[pos:pos + 1]
+    pos += 1
+    if tag == b's':
+        (size,) = _BINARY_SIZE.unpack_from(mm, pos)
+        pos += _BINARY_SIZE.size
+        return str(mm[pos:pos + size], 'utf-8'), pos + size
+    if tag == b'i':
+        return _BINARY_INT.unpack_from(mm, pos)[0], pos + _BINARY_INT.size
+    if tag in (b'm', b'l'):
+        (count,) = _BINARY_SIZE.unpack_from(mm, pos)
+        pos += _BINARY_SIZE.size
+        if tag == b'l':
+            items = []
+            for _ in range(count):
+                item, pos = _decode_value(mm, pos)
+                items.append(item)
+            return items, pos
+        record = {}
+        for _ in range(count):
+            key, pos = _decode_value(mm, pos)
+            if key in stored and mm[pos:pos + 1] == b's':
+                (size,) = _BINARY_SIZE.unpack_from(mm, pos + 1)
+                start = pos + 1 + _BINARY_SIZE.size
+                record[key], pos = _StoredText(mm, start, start + size), start + size
+            else:
+                record[key], pos = _decode_value(mm, pos)
+        return record, pos
+    if tag == b'N':
+        return None, pos
+    if tag in (b'T', b'F'):
+        return tag == b'T', pos
+    if tag == b'd':
+        return _BINARY_FLOAT.unpack_from(mm, pos)[0], pos + _BINARY_FLOAT.size
+    if tag == b'j':
+        (size,) = _BINARY_SIZE.unpack_from(mm, pos)
+        pos += _BINARY_SIZE.size
+        return json.loads(mm[pos:pos + size]), pos + size
+    raise ValueError(f'Unknown value tag {tag!r} at offset {pos - 1}')
+
+def _iter_binary(f, stored=()):
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, kind, count = _BINARY_HEADER.unpack_from(mm, 0)
+        yield kind == b'D'
+        if magic in _BINARY_FRAMED:
+            yield from _iter_framed(mm, magic, count)
+            return
+        for i in range(count):
+            (offset,) = _BINARY_OFFSET.unpack_from(mm, _BINARY_HEADER.size + i * _BINARY_OFFSET.size)
+            yield _decode_value(mm, offset, stored)[0]
+    finally:
+        # Kept open for the _StoredText values; closed once they are gone
+        if not stored:
+            mm.close()
+
+def _iter_framed(mm, magic, count):
+    # BLOGBIN1 files have an offset table before the records, BLOGBIN2 none
+    pos = _BINARY_HEADER.size + (_BINARY_OFFSET.size * count if magic == b'BLOGBIN1' else 0)
+    for _ in range(count):
+        (size,) = _BINARY_SIZE.unpack_from(mm, pos)
+        pos += _BINARY_SIZE.size
+        yield json.loads(mm[pos:pos + size])
+        pos += size
+
+def _iter_jsonl(f):
+    header = json.loads(f.readline())
+    yield header.get('kind') == 'dict'
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+def _iter_json(f):
+    data = json.load(f)
+    yield isinstance(data, dict)
+    yield from data.items() if isinstance(data, dict) else data
+
+def iter_records(filename):
+    """Stream the records of a data file: the first item tells whether the
+    file holds a dict, the rest are its records (or (key, value) pairs).
+    
+    JSON Lines and binary files are read a record at a time; plain JSON has
+    to be parsed whole first.
+    """
+    try:
+        f = open(filename, 'rb')
+    except FileNotFoundError:
+        yield False
+        return
+    with f:
+        data_format = _detect_format(f)
+        if data_format == 'binary':
+            yield from _iter_binary(f, _STORED_TEXT_FIELDS.get(filename, ()))
+        else:
+            yield from (_iter_jsonl if data_format == 'jsonl' else _iter_json)(f)
+
+def _read_snapshot(filename):
+    records = iter_records(filename)
+    is_dict = next(records)
+    return dict(records) if is_dict else list(records)
+
+def _dump_data(data, f, data_format):
+    is_dict = isinstance(data, dict)
+    records = list(data.items()) if is_dict else data
+    if data_format in ('json', 'compact'):
+        if data_format == 'json':
+            f.write(json.dumps(data, indent=2, default=_json_default).encode('utf-8'))
+        else:
+            f.write(json.dumps(data, separators=(',', ':'), default=_json_default).encode('utf-8'))
+    elif data_format == 'jsonl':
+        header = {'format': _JSONL_HEADER, 'kind': 'dict' if is_dict else 'list'}
+        f.write(json.dumps(header).encode('utf-8') + b'\n')
+        for record in records:
+            f.write(json.dumps(record, separators=(',', ':'), default=_json_default).encode('utf-8') + b'\n')
+    elif data_format == 'binary':
+        blobs = []
+        for record in records:
+            blob = bytearray()
+            _encode_value(record, blob)
+            blobs.append(blob)
+        f.write(_BINARY_HEADER.pack(_BINARY_MAGIC, b'D' if is_dict else b'L', len(blobs)))
+        offset = _BINARY_HEADER.size + _BINARY_OFFSET.size * len(blobs)
+        for blob in blobs:
+            f.write(_BINARY_OFFSET.pack(offset))
+            offset += len(blob)
+        for blob in blobs:
+            f.write(blob)
+    else:
+        raise ValueError(f'Unknown data format: {data_format}')
+
+def _write_snapshot(filename, data, data_format=None):
+    """Replace the file atomically: a crash leaves the old or the new contents"""
+    tmp_name = filename + '.tmp'
+    with open(tmp_name, 'wb') as f:
+        _dump_data(data, f, data_format or DATA_FORMAT)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, filename)
+
+def _read_log(filename, offset):
+    """Changes appended to the file's log from `offset` on, and the offset
+    after the last complete line"""
+    try:
+        with open(_log_name(filename), 'rb') as f:
+            f.seek(offset)
+            tail = f.read()
+    except FileNotFoundError:
+        return [], 0
+    complete = tail[:tail.rfind(b'\n') + 1]
+    changes = []
+    for line in complete.splitlines():
+        if not line.strip():
+            continue
+        try:
+            changes.append(json.loads(line))
+        except ValueError:
+            print(f"Error reading {_log_name(filename)}: skipping a damaged entry")
+    return changes, offset + len(complete)
+
+def _index_records(data):
+    """Cache entry fields for a list of records: id -> position and the top id"""
+    if not isinstance(data, list):
+        return {'data': data}
+    positions = {r['id']: i for i, r in enumerate(data) if isinstance(r, dict) and 'id' in r}
+    return {'data': data, 'positions': positions, 'max_id': max(positions, default=0)}
+
+def _apply_changes(entry, changes):
+    """Return a cache entry with the changes applied. The record list is
+    copied, not patched, since readers may be iterating the old one."""
+    records, positions, max_id = list(entry['data']), entry['positions'], entry['max_id']
+    removed = set()
+    for change in changes:
+        record_id = change['id']
+        if change['op'] == 'delete':
+            if record_id in positions:
+                removed.add(positions.pop(record_id))
+        elif record_id in positions:
+            records[positions[record_id]] = change['record']
+        else:
+            positions[record_id] = len(records)
+            records.append(change['record'])
+            max_id = max(max_id, record_id)
+    if removed:
+        records = [r for i, r in enumerate(records) if i not in removed]
+        return _index_records(records)
+    return dict(entry, data=records, positions=positions, max_id=max_id)
+
+def _refresh_entry(filename):
+    """The up-to-date cache entry for a file; call with _data_lock held (and
+    the file lock, for files with a change log)"""
+    stamp = _data_stamp(filename)
+    entry = _data_cache.get(filename)
+    if entry and entry['stamp'] == stamp:
+        return entry
+    if filename not in CHANGE_LOG_FILES:
+        entry = _index_records(_read_snapshot(filename))
+    else:
+        log_size = stamp[1][1] if stamp[1] else 0
+        if not (entry and entry['stamp'][0] == stamp[0] and entry['log_offset'] <= log_size):
+            entry = dict(_index_records(_read_snapshot(filename)), log_offset=0, log_entries=0)
+        changes, offset = _read_log(filename, entry['log_offset'])
+        entry = dict(_apply_changes(entry, changes), log_offset=offset,
+                     log_entries=entry['log_entries'] + len(changes))
+    entry.update(stamp=stamp, version=next(_data_versions))
+    _data_cache[filename] = entry
+    return entry
+
+def peek_data(filename):
+    """Return the cached data for a file without copying it (read-only)"""
+    stamp = _data_stamp(filename)
+    with _data_lock:
+        entry = _data_cache.get(filename)
+        if entry and entry['stamp'] == stamp:
+            return entry['data']
+        if filename not in CHANGE_LOG_FILES:
+            return _refresh_entry(filename)['data']
+    # Hold off compaction while the snapshot and its log are read
+    with _file_lock(filename, shared=True):
+        with _data_lock:
+            return _refresh_entry(filename)['data']
+
 def load_data(filename):
-    if os.path.exists(filename):
-        with open(filename, 'r') as f:
-            return json.load(f)
-    return []
+    """The file's data for a caller that adds, removes or replaces records;
+    see _copy_data. Read-only callers use peek_data."""
+    return _copy_data(peek_data(filename))
 
 def save_data(filename, data):
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
+    """Replace the file's contents; the records become the cached ones, so
+    they must not be changed afterwards"""
+    with _file_lock(filename):
+        with _data_lock:
+            _write_snapshot(filename, data)
+            if filename in CHANGE_LOG_FILES:
+                _remove_log(filename)
+            # Write through so the next read is served from memory
+            entry = _index_records(_copy_data(data))
+            if filename in CHANGE_LOG_FILES:
+                entry.update(log_offset=0, log_entries=0)
+            entry.update(stamp=_data_stamp(filename), version=next(_data_versions))
+            _data_cache[filename] = entry
+
+def _remove_log(filename):
+    try:
+        os.remove(_log_name(filename))
+    except FileNotFoundError:
+        pass
+    with _log_sync:
+        state = _log_state(filename)
+        state['synced'] = state['written']
+        _log_sync.notify_all()
+
+def next_record_id(filename):
+    """Id for a new record; call with the file lock held"""
+    with _data_lock:
+        return _refresh_entry(filename)['max_id'] + 1
+
+def commit_changes(filename, changes):
+    """Store put/delete changes ({'op', 'id', 'record'}) to a collection file.
+    
+    Call with the file lock held. Files with a change log get the changes
+    appended to it; the returned ticket is passed to sync_changes() once the
+    lock is released. Other files are rewritten.
+    """
+    with _data_lock:
+        entry = _refresh_entry(filename)
+        if filename not in CHANGE_LOG_FILES:
+            save_data(filename, _apply_changes(entry, changes)['data'])
+            return None
+        payload = ''.join(json.dumps(c, separators=(',', ':'), default=_json_default) + '\n'
+                          for c in changes).encode('utf-8')
+        with open(_log_name(filename), 'a+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size:
+                # Start on a fresh line if a crash left a partial entry behind
+                f.seek(size - 1)
+                if f.read(1) != b'\n':
+                    payload = b'\n' + payload
+            f.write(payload)
+            size += len(payload)
+        entry = dict(_apply_changes(entry, changes), log_offset=size,
+                     log_entries=entry['log_entries'] + len(changes))
+        entry.update(stamp=_data_stamp(filename), version=next(_data_versions))
+        _data_cache[filename] = entry
+        with _log_sync:
+            state = _log_state(filename)
+            state['written'] += 1
+            ticket = state['written']
+    if entry['log_entries'] >= LOG_COMPACT_ENTRIES:
+        compact_log(filename)
+    return ticket
+
+def compact_log(filename, data_format=None):
+    """Fold a file's change log into its snapshot. With a `data_format` the
+    snapshot is rewritten in that format even if there is no log."""
+    with _file_lock(filename):
+        with _data_lock:
+            entry = _refresh_entry(filename)
+            if data_format is None and not entry.get('log_entries'):
+                return
+            _write_snapshot(filename, entry['data'], data_format)
+            if filename in CHANGE_LOG_FILES:
+                _remove_log(filename)
+                entry.update(log_offset=0, log_entries=0)
+            # Same contents, so the version (and every index built on it) stays
+            entry['stamp'] = _data_stamp(filename)
+
+# Group commit: writers append under the file lock, then wait here for an
+# fsync of the log that started after their append
+_log_sync = threading.Condition()
+_log_states = {}
+
+def _log_state(filename):
+    return _log_states.setdefault(filename, {'written': 0, 'synced': 0, 'syncing': False})
+
+def sync_changes(filename, ticket):
+    """Wait until the log append that returned `ticket` is on disk"""
+    if ticket is None:
+        return
+    with _log_sync:
+        state = _log_state(filename)
+        while state['synced'] < ticket:
+            if state['syncing']:
+                _log_sync.wait()
+                continue
+            state['syncing'] = True
+            target = state['written']
+            _log_sync.release()
+            try:
+                fd = os.open(_log_name(filename), os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except FileNotFoundError:
+                pass  # compacted: the snapshot was fsynced before the log went
+            finally:
+                _log_sync.acquire()
+                state['syncing'] = False
+            state['synced'] = max(state['synced'], target)
+            _log_sync.notify_all()
+
+# SQLite backend. Each table keeps the full record as JSON in `data` and
+# copies the fields the routes look up by into indexed columns. Post bodies
+# and their rendered HTML live in their own columns.
+_SQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY, username TEXT, email TEXT, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS idx_users_username ON users (username);
+CREATE INDEX IF NOT EXISTS idx_users_email ON users (email);
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY, author_id INTEGER, category TEXT, date TEXT,
+    content TEXT, content_html TEXT, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS idx_posts_author ON posts (author_id);
+CREATE INDEX IF NOT EXISTS idx_posts_category ON posts (category);
+CREATE INDEX IF NOT EXISTS idx_posts_date ON posts (date);
+CREATE TABLE IF NOT EXISTS comments (
+    id INTEGER PRIMARY KEY, post_id INTEGER, author_id INTEGER, date TEXT,
+    data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS idx_comments_post ON comments (post_id, date);
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY, slug TEXT, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS view_totals (
+    post_id INTEGER PRIMARY KEY, total INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS daily_views (
+    post_id INTEGER NOT NULL, day TEXT NOT NULL, count INTEGER NOT NULL,
+    PRIMARY KEY (post_id, day));
+CREATE INDEX IF NOT EXISTS idx_daily_views_day ON daily_views (day);
+CREATE TABLE IF NOT EXISTS rollup_views (
+    post_id INTEGER NOT NULL, period TEXT NOT NULL, start TEXT NOT NULL, count INTEGER NOT NULL,
+    PRIMARY KEY (post_id, period, start));
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, version INTEGER NOT NULL);
+"""
+
+_SQL_COLUMNS = {
+    'users': ('username', 'email'),
+    'posts': ('author_id', 'category', 'date', 'content', 'content_html'),
+    'comments': ('post_id', 'author_id', 'date'),
+    'categories': ('slug',),
+}
+
+# Every write to a table bumps its version in `meta`, so workers can tell
+# when their in-memory indexes are out of date
+_SQL_VERSIONED_TABLES = {table: table for table in _SQL_COLUMNS}
+_SQL_VERSIONED_TABLES.update(daily_views='analytics', view_totals='analytics', rollup_views='analytics')
+for _table, _collection in _SQL_VERSIONED_TABLES.items():
+    _SQL_SCHEMA += f"INSERT OR IGNORE INTO meta VALUES ('{_collection}', 0);\n"
+    for _event in ('INSERT', 'UPDATE', 'DELETE'):
+        _SQL_SCHEMA += (
+            f"CREATE TRIGGER IF NOT EXISTS {_table}_{_event.lower()}_version "
+            f"AFTER {_event} ON {_table} BEGIN "
+            f"UPDATE meta SET version = version + 1 WHERE name = '{_collection}'; END;\n")
+
+# Columns added to existing tables after they were first created
+_SQL_ADDED_COLUMNS = {'posts': ('content_html TEXT',)}
+_SQL_BODY_COLUMNS = ('content', 'content_html')
+
+_sql_local = threading.local()
+
+def _sql_add_columns(db):
+    for table, columns in _SQL_ADDED_COLUMNS.items():
+        existing = {row['name'] for row in db.execute(f'PRAGMA table_info({table})')}
+        for column in columns:
+            if column.split()[0] not in existing:
+                try:
+                    db.execute(f'ALTER TABLE {table} ADD COLUMN {column}')
+                except sqlite3.OperationalError:
+                    pass  # added by another worker in the meantime
+
+def get_db():
+    """Return this thread's SQLite connection, creating the schema on first use
+    (and again in a forked worker, which must not share its parent's)"""
+    db = getattr(_sql_local, 'db', None)
+    if db is None or _sql_local.pid != os.getpid():
+        db = sqlite3.connect(SQLITE_DB, timeout=30, isolation_level=None,
+                             check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.executescript(_SQL_SCHEMA)
+        _sql_add_columns(db)
+        _sql_local.db, _sql_local.pid = db, os.getpid()
+    return db
+
+@contextmanager
+def _sql_transaction():
+    db = get_db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        yield db
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+    db.execute('COMMIT')
+
+def _sql_to_record(table, row):
+    record = json.loads(row['data'])
+    record['id'] = row['id']
+    if table == 'posts' and 'content' in row.keys():
+        record['content'] = row['content'] or ''
+    if table == 'posts' and 'content_html' in row.keys() and row['content_html'] is not None:
+        record['content_html'] = row['content_html']
+    return record
+
+def _sql_select(table, where='', params=(), order='id'):
+    sql = f'SELECT * FROM {table}'
+    if where:
+        sql += f' WHERE {where}'
+    rows = get_db().execute(f'{sql} ORDER BY {order}', params).fetchall()
+    return [_sql_to_record(table, row) for row in rows]
+
+def _sql_write(db, table, record):
+    """Insert or replace a record, assigning a new id when it has none"""
+    columns = _SQL_COLUMNS[table]
+    data = {k: v for k, v in record.items() if not (table == 'posts' and k in _SQL_BODY_COLUMNS)}
+    values = [record.get('id')] + [record.get(c) for c in columns] + [json.dumps(data)]
+    placeholders = ', '.join('?' * len(values))
+    cursor = db.execute(
+        f'INSERT OR REPLACE INTO {table} (id, {", ".join(columns)}, data) VALUES ({placeholders})',
+        values)
+    if record.get('id') is None:
+        record['id'] = cursor.lastrowid
+    return record['id']
+
+def _sql_replace_all(table, records):
+    with _sql_transaction() as db:
+        db.execute(f'DELETE FROM {table}')
+        for record in records:
+            _sql_write(db, table, record)
+
+def _sql_load_analytics():
+    post_views = {}
+    db = get_db()
+    for row in db.execute('SELECT post_id, total FROM view_totals'):
+        post_views[str(row['post_id'])] = {'total': row['total'], 'daily': {}}
+    for row in db.execute('SELECT post_id, day, count FROM daily_views ORDER BY day'):
+        entry = post_views.setdefault(str(row['post_id']), {'total': 0, 'daily': {}})
+        entry['daily'][row['day']] = row['count']
+    for row in db.execute('SELECT post_id, period, start, count FROM rollup_views ORDER BY start'):
+        entry = post_views.setdefault(str(row['post_id']), {'total': 0, 'daily': {}})
+        entry.setdefault(_ROLLUP_KEYS[row['period']], {})[row['start']] = row['count']
+    return {'post_views': post_views}
+
+def _sql_save_analytics(analytics):
+    with _sql_transaction() as db:
+        db.execute('DELETE FROM view_totals')
+        db.execute('DELETE FROM daily_views')
+        db.execute('DELETE FROM rollup_views')
+        for post_id, entry in analytics.get('post_views', {}).items():
+            db.execute('INSERT INTO view_totals VALUES (?, ?)', (int(post_id), entry.get('total', 0)))
+            db.executemany('INSERT INTO daily_views VALUES (?, ?, ?)',
+                           [(int(post_id), day, count) for day, count in entry.get('daily', {}).items()])
+            for period, key in _ROLLUP_KEYS.items():
+                db.executemany('INSERT INTO rollup_views VALUES (?, ?, ?, ?)',
+                               [(int(post_id), period, start, count)
+                                for start, count in entry.get(key, {}).items()])
+
+def _sql_version(db, table):
+    row = db.execute('SELECT version FROM meta WHERE name = ?', (table,)).fetchone()
+    return row['version'] if row else 0
+
+def _use_sqlite():
+    return STORAGE_BACKEND == 'sqlite'
+
+_COLLECTION_FILES = {
+    'users': USERS_FILE,
+    'posts': POSTS_FILE,
+    'comments': COMMENTS_FILE,
+    'categories': CATEGORIES_FILE,
+    'analytics': VIEWS_FILE,
+}
+
+def collection_version(collection):
+    """A value that changes whenever the collection is written by any worker"""
+    if _use_sqlite():
+        return _sql_version(get_db(), collection)
+    filename = _COLLECTION_FILES[collection]
+    peek_data(filename)
+    with _data_lock:
+        return _data_cache[filename]['version']
+
+# In-memory indexes derived from a collection. Each index dict carries the
+# collection version it was built from: local writes patch it in place via
+# its update function, anything else (e.g. another worker's write) makes it
+# stale and it is rebuilt on next use.
+_derived_indexes = {name: [] for name in _COLLECTION_FILES}
+_index_lock = threading.RLock()
+
+def register_index(collection, index, update):
+    """Call update(record_id, record) on local writes; record is None on delete"""
+    _derived_indexes[collection].append((index, update))
+
+def fresh_index(collection, index, build):
+    """Rebuild the index with build() if the collection changed since it was built"""
+    version = collection_version(collection)
+    with _index_lock:
+        if index.get('version') != version:
+            build()
+            index['version'] = version
+    return index
+
+def _notify_change(collection, before, after, record_id, record):
+    with _index_lock:
+        for index, update in _derived_indexes[collection]:
+            if index.get('version') == before:
+                update(record_id, record)
+                index['version'] = after
 
 def load_users():
+    if _use_sqlite():
+        return _sql_select('users')
     return load_data(USERS_FILE)
 
 def save_users(users):
+    if _use_sqlite():
+        return _sql_replace_all('users', users)
     save_data(USERS_FILE, users)
 
 def load_posts():
+    if _use_sqlite():
+        return _sql_select('posts')
     return load_data(POSTS_FILE)
 
 def save_posts(posts):
+    if _use_sqlite():
+        return _sql_replace_all('posts', posts)
     save_data(POSTS_FILE, posts)
 
 def load_comments():
+    if _use_sqlite():
+        return _sql_select('comments')
     return load_data(COMMENTS_FILE)
 
 def save_comments(comments):
+    if _use_sqlite():
+        return _sql_replace_all('comments', comments)
     save_data(COMMENTS_FILE, comments)
 
 def load_categories():
+    if _use_sqlite():
+        return _sql_select('categories')
     return load_data(CATEGORIES_FILE)
 
 def save_categories(categories):
+    if _use_sqlite():
+        return _sql_replace_all('categories', categories)
     save_data(CATEGORIES_FILE, categories)
 
+def _file_analytics():
+    """The rolled-up buckets of ANALYTICS_FILE merged with the totals and
+    daily counts of VIEWS_FILE"""
+    post_views = {}
+    for filename in (ANALYTICS_FILE, VIEWS_FILE):
+        for post_id, entry in (peek_data(filename) or {}).get('post_views', {}).items():
+            post_views[post_id] = dict(post_views.get(post_id, {}), **entry)
+    return {'post_views': copy.deepcopy(post_views)}
+
 def load_analytics():
-    return load_data(ANALYTICS_FILE)
+    if _use_sqlite():
+        return _sql_load_analytics()
+    return _file_analytics()
 
 def save_analytics(analytics):
-    save_data(ANALYTICS_FILE, analytics)
+    if _use_sqlite():
+        return _sql_save_analytics(analytics)
+    hot, history = {}, {}
+    for post_id, entry in analytics.get('post_views', {}).items():
+        hot[post_id] = {'total': entry.get('total', 0), 'daily': entry.get('daily', {})}
+        rolled = {key: entry[key] for key in _ROLLUP_KEYS.values() if entry.get(key)}
+        if rolled:
+            history[post_id] = rolled
+    save_data(ANALYTICS_FILE, {'post_views': history})
+    save_data(VIEWS_FILE, {'post_views': hot})
+
+def peek_collection(collection):
+    """All records of a collection for read-only use: the cached list with
+    the JSON backend (not to be modified), a query with SQLite"""
+    if _use_sqlite():
+        return _sql_select(collection)
+    return peek_data(_COLLECTION_FILES[collection])
+
+# Record-level storage operations used by the routes. With SQLite these are
+# indexed queries; with JSON they work on the cached file contents.
+def _find(records, **fields):
+    return next((dict(r) for r in records if all(r.get(k) == v for k, v in fields.items())), None)
+
+def _cached_posts(post_ids):
+    """Id -> cached post record (read-only) for the ids that exist, looked up
+    through the cache entry's positions"""
+    peek_data(POSTS_FILE)
+    with _data_lock:
+        entry = _data_cache[POSTS_FILE]
+        records, positions = entry['data'], entry['positions']
+        return {i: records[positions[i]] for i in post_ids if i in positions}
+
+def get_post(post_id):
+    if _use_sqlite():
+        return next(iter(_sql_select('posts', 'id = ?', (post_id,))), None)
+    post = _cached_posts([post_id]).get(post_id)
+    return _read_stored_text(post) if post else None
+
+def get_posts_by_ids(post_ids):
+    if _use_sqlite():
+        post_ids = list(post_ids)
+        return _sql_select('posts', f'id IN ({", ".join("?" * len(post_ids))})', post_ids)
+    return [_read_stored_text(post) for post in _cached_posts(dict.fromkeys(post_ids)).values()]
+
+# Listing pages only show a post's summary fields, so they read compact
+# summary records and leave the body alone: SQLite summary queries skip the
+# content column, the JSON backend keeps __slots__ summaries of the parsed
+# file. Bodies are fetched separately for the few posts that need them. With
+# the JSON formats the file is still parsed whole, bodies included; a binary
+# posts file leaves bodies in the mapped file (see _StoredText).
+POST_SUMMARY_FIELDS = ('id', 'title', 'category', 'tags', 'author_id', 'date', 'updated_at',
+                       'excerpt', 'reading_time', 'word_count', 'content_hash')
+
+class PostSummary:
+    """A post without its body"""
+    __slots__ = POST_SUMMARY_FIELDS
+    
+    def __init__(self, post):
+        post = with_post_metadata(post)
+        for field in POST_SUMMARY_FIELDS:
+            setattr(self, field, post.get(field))
+        self.tags = tuple(self.tags or ())
+    
+    def as_dict(self):
+        record = {field: getattr(self, field) for field in POST_SUMMARY_FIELDS}
+        record['tags'] = list(self.tags)
+        return record
+
+_post_summaries = {'summaries': {}}
+
+def _build_post_summaries():
+    _post_summaries['summaries'] = {p['id']: PostSummary(dict(p)) for p in peek_data(POSTS_FILE)}
+
+def _update_post_summaries(post_id, post):
+    if post is None:
+        _post_summaries['summaries'].pop(post_id, None)
+    else:
+        _post_summaries['summaries'][post_id] = PostSummary(dict(post))
+
+register_index('posts', _post_summaries, _update_post_summaries)
+
+def _sql_select_summaries(where='', params=()):
+    # Bodies are only read for rows saved before the derived fields existed
+    sql = ("SELECT id, data, CASE WHEN json_extract(data, '$.content_hash') IS NULL "
+           "THEN content END AS content FROM posts")
+    if where:
+        sql += f' WHERE {where}'
+    rows = get_db().execute(f'{sql} ORDER BY id', params).fetchall()
+    return [PostSummary(_sql_to_record('posts', row)) for row in rows]
+
+def get_post_summaries(post_ids=None):
+    """Summaries (posts without 'content') of the given posts in that order,
+    or of every post"""
+    if _use_sqlite():
+        if post_ids is None:
+            return [summary.as_dict() for summary in _sql_select_summaries()]
+        post_ids = list(dict.fromkeys(post_ids))
+        found = {summary.id: summary for summary in
+                 _sql_select_summaries(f'id IN ({", ".join("?" * len(post_ids))})', post_ids)}
+        return [found[i].as_dict() for i in post_ids if i in found]
+    summaries = fresh_index('posts', _post_summaries, _build_post_summaries)['summaries']
+    with _index_lock:
+        post_ids = list(summaries) if post_ids is None else dict.fromkeys(post_ids)
+        return [summaries[i].as_dict() for i in post_ids if i in summaries]
+
+def get_author_summaries(author_id):
+    """Summaries of an author's posts"""
+    if _use_sqlite():
+        return [summary.as_dict() for summary in _sql_select_summaries('author_id = ?', (author_id,))]
+    return get_post_summaries(get_author_post_ids(author_id))
+
+def get_post_bodies(post_ids):
+    """Map of post id -> content for a batch of posts"""
+    post_ids = list(dict.fromkeys(post_ids))
+    if _use_sqlite():
+        rows = get_db().execute(f'SELECT id, content FROM posts WHERE id IN ({", ".join("?" * len(post_ids))})',
+                                post_ids)
+        return {row['id']: row['content'] or '' for row in rows}
+    return {i: str(post.get('content', '')) for i, post in _cached_posts(post_ids).items()}
+
+def _insert_record(collection, record):
+    """Store a new record, assigning its id, and patch the derived indexes"""
+    if _use_sqlite():
+        with _sql_transaction() as db:
+            before = _sql_version(db, collection)
+            _sql_write(db, collection, record)
+            after = _sql_version(db, collection)
+    else:
+        filename = _COLLECTION_FILES[collection]
+        with _file_lock(filename):
+            before = collection_version(collection)
+            record['id'] = next_record_id(filename)
+            ticket = commit_changes(filename, [{'op': 'put', 'id': record['id'], 'record': dict(record)}])
+            after = collection_version(collection)
+        sync_changes(filename, ticket)
+    _notify_change(collection, before, after, record['id'], record)
+    return record['id']
+
+def _update_record(collection, record):
+    if _use_sqlite():
+        with _sql_transaction() as db:
+            before = _sql_version(db, collection)
+            _sql_write(db, collection, record)
+            after = _sql_version(db, collection)
+    else:
+        filename = _COLLECTION_FILES[collection]
+        with _file_lock(filename):
+            before = collection_version(collection)
+            ticket = commit_changes(filename, [{'op': 'put', 'id': record['id'], 'record': dict(record)}])
+            after = collection_version(collection)
+        sync_changes(filename, ticket)
+    _notify_change(collection, before, after, record['id'], record)
+
+def _delete_records(collection, record_ids):
+    record_ids = set(record_ids)
+    if not record_ids:
+        return
+    if _use_sqlite():
+        with _sql_transaction() as db:
+            before = _sql_version(db, collection)
+            db.executemany(f'DELETE FROM {collection} WHERE id = ?', [(i,) for i in record_ids])
+            after = _sql_version(db, collection)
+    else:
+        filename = _COLLECTION_FILES[collection]
+        with _file_lock(filename):
+            before = collection_version(collection)
+            ticket = commit_changes(filename, [{'op': 'delete', 'id': i} for i in record_ids])
+            after = collection_version(collection)
+        sync_changes(filename, ticket)
+    for record_id in record_ids:
+        _notify_change(collection, before, after, record_id, None)
+        before = after
+
+def insert_post(post):
+    """Store a new post, assigning its id"""
+    post.update(post_metadata(post.get('content', '')))
+    return _insert_record('posts', post)
+
+def update_post(post):
+    post.update(post_metadata(post.get('content', '')))
+    _update_record('posts', post)
+
+def remove_post(post_id):
+    """Delete a post together with its comments"""
+    _delete_records('posts', [post_id])
+    _delete_records('comments', [c['id'] for c in get_post_comments(post_id)])
+
+# Id -> user map for the JSON backend, for batched author lookups
+_users_by_id = {'users': {}}
+
+def _build_users_by_id():
+    _users_by_id['users'] = {u['id']: u for u in peek_data(USERS_FILE)}
+
+def _update_users_by_id(user_id, user):
+    if user is None:
+        _users_by_id['users'].pop(user_id, None)
+    else:
+        _users_by_id['users'][user_id] = dict(user)
+
+register_index('users', _users_by_id, _update_users_by_id)
+
+def _user_map():
+    return fresh_index('users', _users_by_id, _build_users_by_id)['users']
+
+def get_user(user_id):
+    if _use_sqlite():
+        return next(iter(_sql_select('users', 'id = ?', (user_id,))), None)
+    user = _user_map().get(user_id)
+    return dict(user) if user else None
+
+def get_users_by_ids(user_ids):
+    """Map of user id -> user for a batch of ids, in one lookup"""
+    user_ids = [i for i in dict.fromkeys(user_ids) if i is not None]
+    if not user_ids:
+        return {}
+    if _use_sqlite():
+        users = _sql_select('users', f'id IN ({", ".join("?" * len(user_ids))})', user_ids)
+        return {u['id']: u for u in users}
+    users = _user_map()
+    return {i: dict(users[i]) for i in user_ids if i in users}
+
+def get_user_by_username(username):
+    if _use_sqlite():
+        return next(iter(_sql_select('users', 'username = ?', (username,))), None)
+    return _find(peek_data(USERS_FILE), username=username)
+
+def get_user_by_email(email):
+    if _use_sqlite():
+        return next(iter(_sql_select('users', 'email = ?', (email,))), None)
+    return _find(peek_data(USERS_FILE), email=email)
+
+def insert_user(user):
+    """Store a new user, assigning its id"""
+    return _insert_record('users', user)
+
+def update_user(user):
+    if has_request_context():
+        g.pop('current_user', None)
+    _update_record('users', user)
+
+# Post id -> comment thread for the JSON backend. Each thread is kept sorted
+# by (date, id), so a post's comments are read in order without a scan of
+# comments.json or a sort (SQLite uses the comments(post_id, date) index).
+_comment_threads = {'threads': {}, 'comments': {}}
+
+def _update_comment_threads(comment_id, comment):
+    threads, comments = _comment_threads['threads'], _comment_threads['comments']
+    old = comments.pop(comment_id, None)
+    if old is not None:
+        thread = threads[old['post_id']]
+        thread.remove((old['date'], comment_id))
+        if not thread:
+            del threads[old['post_id']]
+    if comment is not None:
+        comments[comment_id] = dict(comment)
+        bisect.insort(threads.setdefault(comment['post_id'], []), (comment['date'], comment_id))
+
+def _build_comment_threads():
+    _comment_threads.update(threads={}, comments={})
+    for comment in peek_data(COMMENTS_FILE):
+        comment_id = comment['id']
+        _comment_threads['comments'][comment_id] = comment
+        _comment_threads['threads'].setdefault(comment['post_id'], []).append((comment['date'], comment_id))
+    for thread in _comment_threads['threads'].values():
+        thread.sort()
+
+register_index('comments', _comment_threads, _update_comment_threads)
+
+def get_post_comments(post_id):
+    """Comments on a post, oldest first"""
+    if _use_sqlite():
+        return _sql_select('comments', 'post_id = ?', (post_id,), order='date, id')
+    fresh_index('comments', _comment_threads, _build_comment_threads)
+    with _index_lock:
+        comments = _comment_threads['comments']
+        return [dict(comments[i]) for _, i in _comment_threads['threads'].get(post_id, ())]
+
+def comment_thread_state(post_id):
+    """(count, last date, last id) of a post's comments, without loading them"""
+    if _use_sqlite():
+        return tuple(get_db().execute('SELECT COUNT(*), MAX(date), MAX(id) FROM comments WHERE post_id = ?',
+                                      (post_id,)).fetchone())
+    fresh_index('comments', _comment_threads, _build_comment_threads)
+    with _index_lock:
+        thread = _comment_threads['threads'].get(post_id, ())
+        return (len(thread),) + (thread[-1] if thread else (None, None))
+
+def insert_comment(comment):
+    """Store a new comment, assigning its id"""
+    comment.update(rendered_content(comment.get('content', '')))
+    return _insert_record('comments', comment)
+
+def insert_category(category):
+    """Store a new category, assigning its id"""
+    return _insert_record('categories', category)
+
+def remove_category(category_id):
+    _delete_records('categories', [category_id])
+
+def get_view_total(post_id):
+    """Flushed view count for a post"""
+    if _use_sqlite():
+        row = get_db().execute('SELECT total FROM view_totals WHERE post_id = ?', (post_id,)).fetchone()
+        return row['total'] if row else 0
+    views = peek_data(VIEWS_FILE) or {}
+    return views.get('post_views', {}).get(str(post_id), {}).get('total', 0)
+
+def get_view_totals():
+    """Map of post id -> flushed view count"""
+    if _use_sqlite():
+        return {row['post_id']: row['total'] for row in get_db().execute('SELECT post_id, total FROM view_totals')}
+    views = peek_data(VIEWS_FILE) or {}
+    return {int(post_id): data.get('total', 0) for post_id, data in views.get('post_views', {}).items()}
+
+def get_daily_views(since):
+    """(post_id, day, count) for every flushed daily count from `since` on"""
+    if _use_sqlite():
+        rows = get_db().execute('SELECT post_id, day, count FROM daily_views WHERE day >= ?', (since,))
+        return [(row['post_id'], row['day'], row['count']) for row in rows]
+    
+    views = peek_data(VIEWS_FILE) or {}
+    return [(int(post_id), day, count)
+            for post_id, data in views.get('post_views', {}).items()
+            for day, count in data.get('daily', {}).items() if day >= since]
+
+# Rolled-up view history. Buckets are keyed by the date they start on
+# (Monday for weeks, the 1st for months), so daily, weekly and monthly
+# buckets can be merged into one time series.
+_ROLLUP_KEYS = {'week': 'weekly', 'month': 'monthly'}
+
+def _week_start(day):
+    d = date.fromisoformat(day)
+    return (d - timedelta(days=d.weekday())).isoformat()
+
+def _month_start(day):
+    return day[:8] + '01'
+
+def _rollup_cutoffs(today=None):
+    today = today or date.today()
+    return {'hot': (today - timedelta(days=ANALYTICS_HOT_DAYS)).isoformat(),
+            'weekly': (today - timedelta(days=ANALYTICS_WEEKLY_DAYS)).isoformat()}
+
+def _rollup_buckets(buckets, target, cutoff, bucket_start):
+    """Move the buckets starting before `cutoff` into their coarser bucket in
+    `target`; returns how many were moved"""
+    old = [start for start in buckets if start < cutoff]
+    for start in old:
+        key = bucket_start(start)
+        target[key] = target.get(key, 0) + buckets.pop(start)
+    return len(old)
+
+_SQL_ROLLUPS = (
+    ('week', 'hot', _week_start,
+     'SELECT post_id, day, count FROM daily_views WHERE day < ?',
+     'DELETE FROM daily_views WHERE day < ?'),
+    ('month', 'weekly', _month_start,
+     "SELECT post_id, start, count FROM rollup_views WHERE period = 'week' AND start < ?",
+     "DELETE FROM rollup_views WHERE period = 'week' AND start < ?"),
+)
+
+def rollup_views(today=None):
+    """Fold old daily view counts into weekly buckets and old weekly ones into
+    monthly buckets; returns the number of buckets folded"""
+    cutoffs = _rollup_cutoffs(today)
+    folded = 0
+    if _use_sqlite():
+        with _sql_transaction() as db:
+            before = _sql_version(db, 'analytics')
+            for period, cutoff, bucket_start, select_sql, delete_sql in _SQL_ROLLUPS:
+                rolled = Counter()
+                for post_id, start, count in db.execute(select_sql, (cutoffs[cutoff],)).fetchall():
+                    rolled[(post_id, bucket_start(start))] += count
+                    folded += 1
+                db.execute(delete_sql, (cutoffs[cutoff],))
+                db.executemany(
+                    'INSERT INTO rollup_views VALUES (?, ?, ?, ?) ON CONFLICT (post_id, period, start) '
+                    'DO UPDATE SET count = count + excluded.count',
+                    [(post_id, period, start, count) for (post_id, start), count in rolled.items()])
+            after = _sql_version(db, 'analytics')
+    else:
+        with _file_lock(ANALYTICS_FILE), _file_lock(VIEWS_FILE):
+            before = collection_version('analytics')
+            with _data_lock:
+                _data_cache.pop(ANALYTICS_FILE, None)
+                _data_cache.pop(VIEWS_FILE, None)
+            hot, history = load_data(VIEWS_FILE) or {}, load_data(ANALYTICS_FILE) or {}
+            hot['post_views'] = copy.deepcopy(hot.get('post_views', {}))
+            history['post_views'] = copy.deepcopy(history.get('post_views', {}))
+            moved = 0
+            for post_id, entry in hot['post_views'].items():
+                rolled = history['post_views'].setdefault(post_id, {})
+                moved += _rollup_buckets(entry.get('daily', {}), rolled.setdefault('weekly', {}),
+                                         cutoffs['hot'], _week_start)
+            for rolled in history['post_views'].values():
+                folded += _rollup_buckets(rolled.get('weekly', {}), rolled.setdefault('monthly', {}),
+                                          cutoffs['weekly'], _month_start)
+            folded += moved
+            if folded:
+                # History first: a crash before the views file is replaced
+                # counts the moved days twice rather than losing them
+                save_data(ANALYTICS_FILE, history)
+            if moved:
+                save_data(VIEWS_FILE, hot)
+            after = collection_version('analytics')
+    if folded:
+        _notify_change('analytics', before, after, None, {})
+    return folded
+
+def get_view_history(post_id, start=None, end=None):
+    """Flushed views of a post as ascending (bucket_start, period, count)
+    tuples, period being 'day', 'week' or 'month'. A bucket is included when
+    it starts within [start, end] (ISO dates, both optional)."""
+    start, end = start or '', end or '9999-12-31'
+    if _use_sqlite():
+        db = get_db()
+        rows = [(row['day'], 'day', row['count']) for row in db.execute(
+            'SELECT day, count FROM daily_views WHERE post_id = ? AND day BETWEEN ? AND ?',
+            (post_id, start, end))]
+        rows += [(row['start'], row['period'], row['count']) for row in db.execute(
+            'SELECT period, start, count FROM rollup_views WHERE post_id = ? AND start BETWEEN ? AND ?',
+            (post_id, start, end))]
+        return sorted(rows)
+    daily = (peek_data(VIEWS_FILE) or {}).get('post_views', {}).get(str(post_id), {}).get('daily', {})
+    rolled = (peek_data(ANALYTICS_FILE) or {}).get('post_views', {}).get(str(post_id), {})
+    rows = [(day, 'day', count) for day, count in daily.items() if start <= day <= end]
+    for period, key in _ROLLUP_KEYS.items():
+        rows += [(s, period, count) for s, count in rolled.get(key, {}).items() if start <= s <= end]
+    return sorted(rows)
+
+def record_views(batch):
+    """Add a batch of {(post_id, day): count} view increments to storage"""
+    if _use_sqlite():
+        totals = Counter()
+        for (post_id, day), count in batch.items():
+            totals[post_id] += count
+        with _sql_transaction() as db:
+            before = _sql_version(db, 'analytics')
+            db.executemany(
+                'INSERT INTO daily_views VALUES (?, ?, ?) ON CONFLICT (post_id, day) '
+                'DO UPDATE SET count = count + excluded.count',
+                [(post_id, day, count) for (post_id, day), count in batch.items()])
+            db.executemany(
+                'INSERT INTO view_totals VALUES (?, ?) ON CONFLICT (post_id) '
+                'DO UPDATE SET total = total + excluded.total',
+                list(totals.items()))
+            after = _sql_version(db, 'analytics')
+    else:
+        with _file_lock(VIEWS_FILE):
+            before = collection_version('analytics')
+            # Re-read under the lock so counts flushed by other workers are kept
+            with _data_lock:
+                _data_cache.pop(VIEWS_FILE, None)
+            views = load_data(VIEWS_FILE) or {}
+            post_views = views['post_views'] = dict(views.get('post_views', {}))
+            copied = set()
+            for (post_id, day), count in batch.items():
+                key = str(post_id)
+                if key not in copied:
+                    post_views[key] = copy.deepcopy(post_views.get(key, {'total': 0, 'daily': {}}))
+                    copied.add(key)
+                entry = post_views[key]
+                entry['total'] += count
+                entry['daily'][day] = entry['daily'].get(day, 0) + count
+            save_data(VIEWS_FILE, views)
+            after = collection_version('analytics')
+    _notify_change('analytics', before, after, None, batch)
 
 def login_required(f):
     @wraps(f)
@@ -89,14 +1367,20 @@ def user_required(f):
     return decorated_function
 
 def get_current_user():
-    users = load_users()
-    
+    """The logged-in user, looked up once per request and kept on flask.g"""
+    key = (session.get('admin_id'), session.get('user_id'))
+    cached = g.get('current_user')
+    if cached is None or cached[0] != key:
+        cached = g.current_user = (key, _lookup_current_user())
+    return cached[1]
+
+def _lookup_current_user():
     # Check for admin session
     if 'admin_id' in session:
-        user = next((u for u in users if u['id'] == session['admin_id']), None)
+        user = get_user(session['admin_id'])
     # Check for user session
     elif 'user_id' in session:
-        user = next((u for u in users if u['id'] == session['user_id']), None)
+        user = get_user(session['user_id'])
     else:
         return None
     
@@ -110,30 +1394,206 @@ def get_current_user():
             user['last_login'] = None
     return user
 
+# Background jobs. View events and new comments are queued in a local SQLite
+# file (JOB_QUEUE_DB) and acknowledged right away; a worker thread in each
+# process applies the jobs it queued in batches, views every
+# VIEW_FLUSH_INTERVAL seconds or once VIEW_FLUSH_THRESHOLD are pending and
+# comments as soon as they arrive. Queue inserts are WAL appends without an
+# fsync, so requests never wait on the disk. Jobs are deleted only after
+# they have been applied, so a crash replays them (at-least-once): comments
+# carry a submission id and replays of stored ones are skipped, while views
+# may be counted twice. Every worker renews a lease in the `workers` table
+# before each batch; jobs whose owner has not renewed it for
+# JOB_LEASE_SECONDS (a process that died, in this or an earlier container)
+# are adopted by the next worker that runs. drain_jobs() applies everything
+# queued so far; it runs at exit in processes that used the queue and from
+# the gunicorn worker_exit hook (gunicorn.conf.py).
+_JOB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY, kind TEXT NOT NULL, origin TEXT NOT NULL,
+    owner TEXT NOT NULL, payload TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs (owner, id);
+CREATE TABLE IF NOT EXISTS workers (token TEXT PRIMARY KEY, heartbeat REAL NOT NULL);
+"""
+
+_job_local = threading.local()
+_jobs = {'pid': None, 'token': None}
+_jobs_lock = threading.Lock()
+_jobs_drain_lock = threading.Lock()
+_jobs_wakeup = threading.Event()
+
+# View increments queued by this process and not applied yet, keyed by
+# (post_id, day), plus per-post totals so get_post_views() includes them
+_pending_views = Counter()
+_pending_view_totals = Counter()
+_views_lock = threading.Lock()
+
+def _job_db():
+    """This thread's connection to the job queue"""
+    db = getattr(_job_local, 'db', None)
+    if db is None or _job_local.pid != os.getpid():
+        db = sqlite3.connect(JOB_QUEUE_DB, timeout=30, isolation_level=None,
+                             check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.executescript(_JOB_SCHEMA)
+        _job_local.db, _job_local.pid = db, os.getpid()
+    return db
+
+def _job_token():
+    """This process's owner token ('<pid>:<random>'), starting its worker
+    thread on first use (after a fork as well)"""
+    with _jobs_lock:
+        if _jobs['pid'] != os.getpid():
+            _jobs.update(pid=os.getpid(), token=f'{os.getpid()}:{os.urandom(4).hex()}')
+            _renew_job_lease(_job_db(), _jobs['token'])
+            threading.Thread(target=_job_worker, name='job-worker', daemon=True).start()
+        return _jobs['token']
+
+def _job_worker():
+    while True:
+        _jobs_wakeup.wait(VIEW_FLUSH_INTERVAL)
+        _jobs_wakeup.clear()
+        try:
+            drain_jobs()
+        except Exception as e:
+            print(f"Error processing background jobs: {e}")
+
+def enqueue_job(kind, payload, wake=False):
+    """Queue a job for the background worker"""
+    token = _job_token()
+    _job_db().execute('INSERT INTO jobs (kind, origin, owner, payload) VALUES (?, ?, ?, ?)',
+                      (kind, token, token, json.dumps(payload)))
+    if wake:
+        _jobs_wakeup.set()
+
+def _renew_job_lease(db, token):
+    db.execute('INSERT OR REPLACE INTO workers VALUES (?, ?)', (token, time.time()))
+
+def _adopt_orphaned_jobs(db, token):
+    """Take over the jobs of owners whose lease has expired"""
+    expired = time.time() - JOB_LEASE_SECONDS
+    db.execute('DELETE FROM workers WHERE heartbeat < ?', (expired,))
+    owners = db.execute('SELECT DISTINCT owner FROM jobs WHERE owner != ? AND owner NOT IN '
+                        '(SELECT token FROM workers)', (token,)).fetchall()
+    for row in owners:
+        db.execute('UPDATE jobs SET owner = ? WHERE owner = ?', (token, row['owner']))
+
 def track_view(post_id, user_id=None):
     """Track post views for analytics"""
-    analytics = load_analytics()
+    post_id = int(post_id)
     today = datetime.now().strftime('%Y-%m-%d')
     
-    if 'post_views' not in analytics:
-        analytics['post_views'] = {}
-    
-    if str(post_id) not in analytics['post_views']:
-        analytics['post_views'][str(post_id)] = {'total': 0, 'daily': {}}
-    
-    analytics['post_views'][str(post_id)]['total'] += 1
+    # Counted as pending before the job exists, so a drain that picks it up
+    # right away always finds the increment to take back
+    with _views_lock:
+        _pending_views[(post_id, today)] += 1
+        _pending_view_totals[post_id] += 1
+        pending = sum(_pending_view_totals.values())
+    try:
+        enqueue_job('view', [post_id, today])
+    except Exception as e:
+        _take_pending_views({(post_id, today): 1})
+        print(f"Error queueing view of post {post_id}: {e}")
+        return
+    _add_trending_view(post_id, date.today().toordinal())
     
-    if today not in analytics['post_views'][str(post_id)]['daily']:
-        analytics['post_views'][str(post_id)]['daily'][today] = 0
+    if pending >= VIEW_FLUSH_THRESHOLD:
+        _jobs_wakeup.set()
+
+def _take_pending_views(counts):
+    """Remove {(post_id, day): count} from the pending view counters"""
+    with _views_lock:
+        for (post_id, day), count in counts.items():
+            _pending_views[(post_id, day)] -= count
+            _pending_view_totals[post_id] -= count
+            if _pending_views[(post_id, day)] <= 0:
+                del _pending_views[(post_id, day)]
+            if _pending_view_totals[post_id] <= 0:
+                del _pending_view_totals[post_id]
+
+def _apply_view_jobs(rows, token):
+    """Add a batch of view events to storage"""
+    batch, local = Counter(), Counter()
+    for row in rows:
+        post_id, day = json.loads(row['payload'])
+        batch[(post_id, day)] += 1
+        if row['origin'] == token:
+            local[(post_id, day)] += 1
     
-    analytics['post_views'][str(post_id)]['daily'][today] += 1
+    _take_pending_views(local)
+    try:
+        record_views(dict(batch))
+    except Exception:
+        # Keep the increments visible until the jobs are retried
+        with _views_lock:
+            for (post_id, day), count in local.items():
+                _pending_views[(post_id, day)] += count
+                _pending_view_totals[post_id] += count
+        raise
+
+def _apply_comment_job(comment):
+    """Store a queued comment, unless a replay of it was stored already"""
+    stored = get_post_comments(comment['post_id'])
+    if not any(c.get('submission_id') == comment['submission_id'] for c in stored):
+        insert_comment(comment)
+
+_last_rollup = None
+
+def drain_jobs():
+    """Apply every job queued by this process (and by processes that died)"""
+    token = _job_token()
+    with _jobs_drain_lock:
+        db = _job_db()
+        _adopt_orphaned_jobs(db, token)
+        while True:
+            # Renewed per batch, so a long drain keeps its jobs
+            _renew_job_lease(db, token)
+            rows = db.execute('SELECT id, kind, origin, payload FROM jobs WHERE owner = ? '
+                              'ORDER BY id LIMIT ?', (token, JOB_BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            done = []
+            views = [row for row in rows if row['kind'] == 'view']
+            if views:
+                try:
+                    _apply_view_jobs(views, token)
+                    done += [row['id'] for row in views]
+                except Exception as e:
+                    print(f"Error flushing view counts: {e}")
+            for row in rows:
+                if row['kind'] == 'comment':
+                    try:
+                        _apply_comment_job(json.loads(row['payload']))
+                        done.append(row['id'])
+                    except Exception as e:
+                        print(f"Error storing comment job {row['id']}: {e}")
+            if done:
+                db.execute(f'DELETE FROM jobs WHERE id IN ({", ".join("?" * len(done))})', done)
+            if len(done) < len(rows) or len(rows) < JOB_BATCH_SIZE:
+                break  # failed jobs are retried on the next run
     
-    save_analytics(analytics)
+    # Roll up old history once a day (per worker; rolling up twice is harmless)
+    global _last_rollup
+    today = date.today()
+    if _last_rollup != today:
+        _last_rollup = today
+        try:
+            rollup_views(today)
+        except Exception as e:
+            print(f"Error rolling up view history: {e}")
+
+def _drain_jobs_at_exit():
+    # Processes that never touched the queue (CLI commands, imports) skip it
+    if _jobs['pid'] == os.getpid():
+        drain_jobs()
+
+atexit.register(_drain_jobs_at_exit)
 
 def get_post_views(post_id):
     """Get total views for a post"""
-    analytics = load_analytics()
-    return analytics.get('post_views', {}).get(str(post_id), {}).get('total', 0)
+    return get_view_total(post_id) + _pending_view_totals.get(int(post_id), 0)
 
 def get_reading_time(content):
     """Calculate estimated reading time"""
@@ -143,92 +1603,926 @@ def get_reading_time(content):
     minutes = max(1, round(words / 200))  # Average reading speed: 200 words per minute
     return minutes
 
+# Fields derived from a post's content are computed when the post is saved
+# and stored with it, so listings never re-split or slice the body and post
+# pages never re-escape it.
+
+def content_hash(content):
+    return hashlib.sha1(str(content).encode('utf-8')).hexdigest()
+
+def render_content(content):
+    """Display HTML of a post or comment body: escaped, with line breaks"""
+    return str(escape(str(content or '')).replace('\n', Markup('<br>\n')))
+
+def rendered_content(content):
+    """Rendered HTML of a body together with the hash of the text it was
+    rendered from"""
+    return {'content_html': render_content(content), 'content_hash': content_hash(content or '')}
+
+def with_content_html(record):
+    """Fill in the rendered HTML of a post or comment saved without it"""
+    if record.get('content_html') is None:
+        record.update(rendered_content(record.get('content', '')))
+    return record
+
+def post_metadata(content):
+    """Word count, reading time, plain-text excerpt, rendered HTML and hash
+    of a post body"""
+    content = str(content or '')
+    text = ' '.join(content.split())
+    return {
+        'word_count': len(content.split()),
+        'reading_time': get_reading_time(content),
+        'excerpt': text[:EXCERPT_LENGTH] + '...' if len(text) > EXCERPT_LENGTH else text,
+        **rendered_content(content),
+    }
+
+def with_post_metadata(post):
+    """Fill in the derived fields of a post saved before they were stored"""
+    if 'content_hash' not in post:
+        post.update(post_metadata(post.get('content', '')))
+    return post
+
+# Trending engine: day buckets of view counts for the rolling window, the
+# weighted score of every post viewed in it and the top TRENDING_TOP_K ids.
+# Views tracked by this worker are added as they happen; flushes from other
+# workers make the analytics version change and the engine is rebuilt.
+_trending = {'today': None, 'buckets': {}, 'scores': Counter(), 'top': []}
+
+def _trending_key(post_id):
+    return (-_trending['scores'][post_id], post_id)
+
+def _rescore_trending():
+    today = _trending['today']
+    scores = Counter()
+    for ordinal, counts in _trending['buckets'].items():
+        weight = TRENDING_DECAY ** (today - ordinal)
+        for post_id, count in counts.items():
+            scores[post_id] += count * weight
+    _trending['scores'] = scores
+    _trending['top'] = heapq.nsmallest(TRENDING_TOP_K, scores, key=_trending_key)
+
+def _roll_trending_window():
+    """Drop day buckets that fell out of the window when the date changes"""
+    today = date.today().toordinal()
+    if _trending['today'] != today:
+        _trending['today'] = today
+        for ordinal in list(_trending['buckets']):
+            if ordinal <= today - TRENDING_DAYS:
+                del _trending['buckets'][ordinal]
+        _rescore_trending()
+
+def _build_trending():
+    today = date.today().toordinal()
+    since = date.fromordinal(today - TRENDING_DAYS + 1).isoformat()
+    views = get_daily_views(since)
+    with _views_lock:
+        views += [(post_id, day, count) for (post_id, day), count in _pending_views.items()]
+    
+    buckets = {}
+    for post_id, day, count in views:
+        ordinal = date.fromisoformat(day).toordinal()
+        if since <= day and ordinal <= today:
+            buckets.setdefault(ordinal, Counter())[post_id] += count
+    _trending.update(today=today, buckets=buckets)
+    _rescore_trending()
+
+# Local flushes carry views that were already added by track_view()
+register_index('analytics', _trending, lambda record_id, batch: None)
+
+def _add_trending_view(post_id, ordinal):
+    with _index_lock:
+        if _trending.get('version') is None:
+            return  # not built yet, the build picks up pending views
+        _roll_trending_window()
+        _trending['buckets'].setdefault(ordinal, Counter())[post_id] += 1
+        _trending['scores'][post_id] += TRENDING_DECAY ** (_trending['today'] - ordinal)
+        
+        # Scores only grow between rebuilds, so the top list stays exact
+        top = _trending['top']
+        if post_id in top:
+            top.sort(key=_trending_key)
+        elif len(top) < TRENDING_TOP_K:
+            top.append(post_id)
+            top.sort(key=_trending_key)
+        elif _trending_key(post_id) < _trending_key(top[-1]):
+            top[-1] = post_id
+            top.sort(key=_trending_key)
+
+def get_trending_ids(limit=TRENDING_TOP_K):
+    """Ids of the most viewed posts in the trending window, best first"""
+    fresh_index('analytics', _trending, _build_trending)
+    with _index_lock:
+        _roll_trending_window()
+        return _trending['top'][:limit]
+
 def get_trending_posts(limit=5):
     """Get trending posts based on recent views"""
-    analytics = load_analytics()
-    posts = load_posts()
+    trending_ids = get_trending_ids(limit)
+    trending_posts = get_posts_by_ids(trending_ids)
+    position = {post_id: i for i, post_id in enumerate(trending_ids)}
+    trending_posts.sort(key=lambda p: position[p['id']])
     
-    # Get views from last 7 days
-    recent_views = {}
-    end_date = datetime.now()
+    return trending_posts
+
+# Listing orders for keyset pagination. Each order is an ascending list of
+# (sort key..., post_id) tuples: the date order is patched on every post
+# write, the popular and trending orders are rebuilt when views or the
+# trending ranking change. A page is a slice of one of these lists, so it
+# only touches the posts it shows.
+LISTING_SORTS = ('newest', 'oldest', 'popular', 'trending')
+
+_post_order = {'by_date': [], 'dates': {}, 'ranked': {}}
+
+def _update_post_order(post_id, post):
+    by_date, dates = _post_order['by_date'], _post_order['dates']
+    if post_id in dates:
+        by_date.remove((dates.pop(post_id), post_id))
+    if post is not None:
+        dates[post_id] = post.get('date', '')
+        bisect.insort(by_date, (dates[post_id], post_id))
+    _post_order['ranked'] = {}
+
+def _build_post_order():
+    dates = {p['id']: p.get('date', '') for p in peek_collection('posts')}
+    _post_order.update(by_date=sorted((d, i) for i, d in dates.items()), dates=dates, ranked={})
+
+register_index('posts', _post_order, _update_post_order)
+
+def listing_order(sort_by):
+    """Ascending key list for a sort; 'newest' is read from the end"""
+    fresh_index('posts', _post_order, _build_post_order)
+    if sort_by in ('newest', 'oldest'):
+        return _post_order['by_date']
     
-    for post_id, data in analytics.get('post_views', {}).items():
-        recent_count = 0
-        for i in range(7):
-            date = (end_date - timedelta(days=i)).strftime('%Y-%m-%d')
-            recent_count += data.get('daily', {}).get(date, 0)
-        
-        if recent_count > 0:
-            recent_views[int(post_id)] = recent_count
+    trending_ids = get_trending_ids()
+    stamp = (collection_version('analytics'), tuple(trending_ids) if sort_by == 'trending' else None)
+    with _index_lock:
+        cached = _post_order['ranked'].get(sort_by)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        post_ids = [post_id for _, post_id in reversed(_post_order['by_date'])]
+        if sort_by == 'popular':
+            views = get_view_totals()
+            keys = sorted((-views.get(i, 0), i) for i in post_ids)
+        else:
+            ranked = [i for i in trending_ids if i in _post_order['dates']]
+            ranked_set = set(ranked)
+            ranked += [i for i in post_ids if i not in ranked_set]
+            keys = [(position, i) for position, i in enumerate(ranked)]
+        _post_order['ranked'][sort_by] = (stamp, keys)
+        return keys
+
+def listing_page(sort_by, limit, offset=0, after=None):
+    """(post_ids, last_key, total) for one page of a listing order.
+    
+    `after` is the key of the last post of the previous page (a cursor);
+    without it the page starts `offset` posts into the order.
+    """
+    keys = listing_order(sort_by)
+    descending = sort_by == 'newest'
+    with _index_lock:
+        if descending:
+            end = bisect.bisect_left(keys, after) if after is not None else len(keys) - offset
+            page = keys[max(0, end - limit):max(0, end)][::-1]
+            has_more = end - limit > 0
+        else:
+            start = bisect.bisect_right(keys, after) if after is not None else offset
+            page = keys[start:start + limit]
+            has_more = start + limit < len(keys)
+        total = len(keys)
+    return [key[-1] for key in page], (page[-1] if page and has_more else None), total
+
+def encode_cursor(sort_by, key):
+    if key is None:
+        return None
+    raw = json.dumps([sort_by, list(key)], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, sort_by):
+    """The sort key stored in a cursor; raises ValueError if it is invalid"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, key = json.loads(raw)
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if cursor_sort != sort_by or not isinstance(key, list) or len(key) != 2:
+        raise ValueError('Invalid cursor')
+    # Keys must compare with the listing order's (date, id) or (rank, id)
+    first_types = (str,) if sort_by in ('newest', 'oldest') else (int, float)
+    first, post_id = key
+    if (not isinstance(first, first_types) or isinstance(first, bool) or
+            not isinstance(post_id, int) or isinstance(post_id, bool)):
+        raise ValueError('Invalid cursor')
+    return tuple(key)
+
+# Category and tag -> post id sets, the secondary indexes behind the /blog
+# filters and the tag cloud. They are built from the post summaries alone.
+_taxonomy_index = {'categories': {}, 'tags': {}, 'post_meta': {}}
+
+def _discard_indexed(index, key, post_id):
+    ids = index.get(key)
+    if ids is not None:
+        ids.discard(post_id)
+        if not ids:
+            del index[key]
+
+def _update_taxonomy_index(post_id, post):
+    meta = _taxonomy_index['post_meta'].pop(post_id, None)
+    if meta is not None:
+        category, tags = meta
+        _discard_indexed(_taxonomy_index['categories'], category, post_id)
+        for tag in tags:
+            _discard_indexed(_taxonomy_index['tags'], tag, post_id)
+    if post is not None:
+        category, tags = post.get('category'), frozenset(post.get('tags') or ())
+        _taxonomy_index['post_meta'][post_id] = (category, tags)
+        _taxonomy_index['categories'].setdefault(category, set()).add(post_id)
+        for tag in tags:
+            _taxonomy_index['tags'].setdefault(tag, set()).add(post_id)
+
+def _build_taxonomy_index():
+    _taxonomy_index.update(categories={}, tags={}, post_meta={})
+    for post in get_post_summaries():
+        _update_taxonomy_index(post['id'], post)
+
+register_index('posts', _taxonomy_index, _update_taxonomy_index)
+
+def posts_in_category(slug):
+    """Set of ids of the posts filed under a category"""
+    fresh_index('posts', _taxonomy_index, _build_taxonomy_index)
+    with _index_lock:
+        return set(_taxonomy_index['categories'].get(slug, ()))
+
+def posts_with_tag(tag):
+    """Set of ids of the posts carrying a tag"""
+    fresh_index('posts', _taxonomy_index, _build_taxonomy_index)
+    with _index_lock:
+        return set(_taxonomy_index['tags'].get(tag, ()))
+
+def category_counts():
+    """Map of category slug -> number of posts"""
+    fresh_index('posts', _taxonomy_index, _build_taxonomy_index)
+    with _index_lock:
+        return {slug: len(ids) for slug, ids in _taxonomy_index['categories'].items()}
+
+def tag_counts():
+    """Map of tag -> number of posts"""
+    fresh_index('posts', _taxonomy_index, _build_taxonomy_index)
+    with _index_lock:
+        return {tag: len(ids) for tag, ids in _taxonomy_index['tags'].items()}
+
+# Related posts are precomputed on top of the category and tag index: every
+# post keeps its top RELATED_POSTS_STORED related posts as (-score, id) keys,
+# and 'referrers' maps a post to the posts listing it. A write that keeps a
+# post's category and tags changes no score. Otherwise the post itself is
+# rescored, and each post sharing a category or tag with it (before or
+# after) only compares the post's new score with its own N-th best, unless
+# it already listed the post, in which case it is rescored.
+RELATED_POSTS_STORED = 6
+RELATED_CATEGORY_SCORE = 3
+RELATED_TAG_SCORE = 2
+RELATED_SIMILARITY_WEIGHT = 4  # applied to the TF-IDF cosine in SIMILARITY_FILE
+
+_related_index = {'post_meta': {}, 'related': {}, 'referrers': {}}
+
+def _related_candidates(category, tags):
+    candidates = set(_taxonomy_index['categories'].get(category, ()))
+    for tag in tags:
+        candidates |= _taxonomy_index['tags'].get(tag, set())
+    return candidates
+
+def _related_score(post_id, other_id, similar):
+    """Score of other_id as a post related to post_id"""
+    category, tags = _related_index['post_meta'][post_id]
+    other_category, other_tags = _related_index['post_meta'][other_id]
+    score = len(tags & other_tags) * RELATED_TAG_SCORE
+    if other_category == category:
+        score += RELATED_CATEGORY_SCORE
+    return score + similar.get(str(other_id), 0) * RELATED_SIMILARITY_WEIGHT
+
+def _similar_posts(post_id):
+    return (peek_data(SIMILARITY_FILE) or {}).get(str(post_id), {})
+
+def _set_related(post_id, top):
+    for _, other_id in _related_index['related'].get(post_id, ()):
+        _discard_indexed(_related_index['referrers'], other_id, post_id)
+    _related_index['related'][post_id] = top
+    for _, other_id in top:
+        _related_index['referrers'].setdefault(other_id, set()).add(post_id)
+
+def _score_related(post_id):
+    similar = _similar_posts(post_id)
+    others = _related_candidates(*_related_index['post_meta'][post_id])
+    others.update(int(other_id) for other_id in similar)
+    others.discard(post_id)
+    keys = ((-_related_score(post_id, other_id, similar), other_id)
+            for other_id in others if other_id in _related_index['post_meta'])
+    _set_related(post_id, heapq.nsmallest(RELATED_POSTS_STORED, (key for key in keys if key[0] < 0)))
+
+def _offer_related(post_id, other_id):
+    """Put other_id into post_id's related list if it now scores high enough"""
+    key = (-_related_score(post_id, other_id, _similar_posts(post_id)), other_id)
+    top = _related_index['related'].get(post_id, [])
+    if key[0] < 0 and (len(top) < RELATED_POSTS_STORED or key < top[-1]):
+        _set_related(post_id, sorted(top + [key])[:RELATED_POSTS_STORED])
+
+def _update_related_index(post_id, post):
+    old_meta = _related_index['post_meta'].get(post_id)
+    new_meta = _taxonomy_index['post_meta'].get(post_id) if post is not None else None
+    if old_meta == new_meta:
+        return  # same category and tags: no score changed
     
-    # Sort posts by recent views
-    trending_ids = sorted(recent_views.keys(), key=lambda x: recent_views[x], reverse=True)[:limit]
-    trending_posts = [p for p in posts if p['id'] in trending_ids]
+    neighbours = _related_index['referrers'].get(post_id, set()).copy()
+    if old_meta is not None:
+        neighbours |= _related_candidates(*old_meta)
+    if new_meta is None:
+        del _related_index['post_meta'][post_id]
+        _set_related(post_id, [])
+        del _related_index['related'][post_id]
+    else:
+        _related_index['post_meta'][post_id] = new_meta
+        neighbours |= _related_candidates(*new_meta)
+        _score_related(post_id)
+    neighbours.discard(post_id)
     
-    return trending_posts
+    listed_by = set(_related_index['referrers'].get(post_id, ()))
+    for other_id in neighbours:
+        if other_id not in _related_index['post_meta']:
+            continue
+        if other_id in listed_by:
+            _score_related(other_id)  # the post's score may have dropped
+        elif new_meta is not None:
+            _offer_related(other_id, post_id)
+
+def _build_related_index():
+    fresh_index('posts', _taxonomy_index, _build_taxonomy_index)
+    _related_index.update(post_meta=dict(_taxonomy_index['post_meta']), related={}, referrers={})
+    for post_id in _related_index['post_meta']:
+        _score_related(post_id)
+    _related_index['similarity_stamp'] = _file_stamp(SIMILARITY_FILE)
+
+register_index('posts', _related_index, _update_related_index)
 
 def get_related_posts(post, limit=3):
     """Get related posts based on tags and category"""
-    posts = load_posts()
-    current_tags = set(post.get('tags', []))
-    current_category = post.get('category')
+    if _related_index.get('similarity_stamp') != _file_stamp(SIMILARITY_FILE):
+        _related_index['version'] = None
+    fresh_index('posts', _related_index, _build_related_index)
+    with _index_lock:
+        if post['id'] not in _related_index['related']:
+            return []
+        related_ids = [other_id for _, other_id in _related_index['related'][post['id']][:limit]]
     
-    scored_posts = []
-    for p in posts:
-        if p['id'] == post['id']:
+    return get_post_summaries(related_ids)
+
+def compute_similarity(posts, neighbours=10):
+    """TF-IDF cosine similarity between post bodies, keeping the closest
+    `neighbours` posts of each one: {post_id: {other_id: similarity}}"""
+    doc_terms = {p['id']: Counter(tokenize(str(p.get('content', '')))) for p in posts}
+    doc_freq = Counter(term for terms in doc_terms.values() for term in terms)
+    total = len(doc_terms)
+    
+    vectors = {}
+    postings = {}
+    for post_id, terms in doc_terms.items():
+        length = sum(terms.values())
+        weights = {t: (n / length) * math.log(total / doc_freq[t]) for t, n in terms.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1
+        vectors[post_id] = {t: w / norm for t, w in weights.items() if w > 0}
+        for term, weight in vectors[post_id].items():
+            postings.setdefault(term, []).append((post_id, weight))
+    
+    similarity = {}
+    for post_id, vector in vectors.items():
+        dots = Counter()
+        for term, weight in vector.items():
+            for other_id, other_weight in postings[term]:
+                if other_id != post_id:
+                    dots[other_id] += weight * other_weight
+        similarity[str(post_id)] = {str(other_id): round(score, 4)
+                                    for other_id, score in dots.most_common(neighbours)}
+    return similarity
+
+# Inverted index over posts for search: term -> {post_id: {field: count}}.
+# Field weights match the original substring scoring and double as the
+# field boosts of the BM25 ranking mode. Token offsets within the content
+# are kept per post for building highlighted snippets.
+SEARCH_FIELD_WEIGHTS = {'title': 3, 'content': 1, 'tags': 2, 'category': 2}
+SEARCH_MODES = ('basic', 'bm25')
+BM25_K1 = 1.2
+BM25_B = 0.75
+SNIPPET_LENGTH = 160
+_TOKEN_RE = re.compile(r'\w+')
+
+_search_index = {'postings': {}, 'doc_terms': {}, 'terms': None,
+                 'doc_lengths': {}, 'field_totals': Counter(), 'positions': {}}
+
+def tokenize(text):
+    return _TOKEN_RE.findall(str(text).lower())
+
+def _post_fields(post):
+    return {
+        'title': post.get('title', ''),
+        'content': post.get('content', ''),
+        'tags': ' '.join(post.get('tags', [])),
+        'category': post.get('category') or '',
+    }
+
+def _unindex_post(post_id):
+    postings = _search_index['postings']
+    for term in _search_index['doc_terms'].pop(post_id, ()):
+        docs = postings.get(term)
+        if docs is not None:
+            docs.pop(post_id, None)
+            if not docs:
+                del postings[term]
+                _search_index['terms'] = None
+    _search_index['field_totals'].subtract(_search_index['doc_lengths'].pop(post_id, {}))
+    _search_index['positions'].pop(post_id, None)
+
+def _index_post(post_id, post):
+    _unindex_post(post_id)
+    if post is None:
+        return
+    postings = _search_index['postings']
+    terms = set()
+    lengths = {}
+    positions = {}
+    for field, text in _post_fields(post).items():
+        length = 0
+        for match in _TOKEN_RE.finditer(str(text)):
+            term = match.group().lower()
+            docs = postings.get(term)
+            if docs is None:
+                docs = postings[term] = {}
+                _search_index['terms'] = None
+            fields = docs.setdefault(post_id, {})
+            fields[field] = fields.get(field, 0) + 1
+            terms.add(term)
+            if field == 'content':
+                positions.setdefault(term, []).append(match.start())
+            length += 1
+        lengths[field] = length
+    _search_index['doc_terms'][post_id] = terms
+    _search_index['doc_lengths'][post_id] = lengths
+    _search_index['field_totals'].update(lengths)
+    _search_index['positions'][post_id] = positions
+
+def _build_search_index():
+    _search_index.update(postings={}, doc_terms={}, terms=None,
+                         doc_lengths={}, field_totals=Counter(), positions={})
+    for post in peek_collection('posts'):
+        _index_post(post['id'], post)
+
+register_index('posts', _search_index, _index_post)
+
+def _expand_term(term, prefix):
+    """Indexed terms matching a query term, by prefix for the last query term"""
+    if not prefix:
+        return [term] if term in _search_index['postings'] else []
+    if _search_index['terms'] is None:
+        _search_index['terms'] = sorted(_search_index['postings'])
+    terms = _search_index['terms']
+    start = bisect.bisect_left(terms, term)
+    end = bisect.bisect_left(terms, term + '\uffff', start)
+    return terms[start:end]
+
+def _term_postings(match, post_ids=None):
+    """(post_id, field counts) pairs of a term, limited to post_ids if given"""
+    docs = _search_index['postings'][match]
+    if post_ids is None:
+        return docs.items()
+    if len(docs) <= len(post_ids):
+        return [(post_id, fields) for post_id, fields in docs.items() if post_id in post_ids]
+    return [(post_id, docs[post_id]) for post_id in post_ids if post_id in docs]
+
+def _basic_term_scores(matches, post_ids=None):
+    scores = Counter()
+    for match in matches:
+        for post_id, fields in _term_postings(match, post_ids):
+            scores[post_id] += sum(SEARCH_FIELD_WEIGHTS[f] * n for f, n in fields.items())
+    return scores
+
+def _bm25_term_scores(matches, post_ids=None):
+    """BM25F: boosted, length-normalised term frequency summed over fields"""
+    doc_count = len(_search_index['doc_lengths']) or 1
+    avg_lengths = {f: (_search_index['field_totals'][f] / doc_count) or 1 for f in SEARCH_FIELD_WEIGHTS}
+    scores = Counter()
+    for match in matches:
+        docs = _search_index['postings'][match]
+        idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+        for post_id, fields in _term_postings(match, post_ids):
+            lengths = _search_index['doc_lengths'][post_id]
+            tf = sum(SEARCH_FIELD_WEIGHTS[f] * n / (1 - BM25_B + BM25_B * lengths[f] / avg_lengths[f])
+                     for f, n in fields.items())
+            scores[post_id] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1)
+    return scores
+
+def _score_query(query_terms, mode, candidates=None):
+    """{post_id: score} of the posts matching every query term, only looking
+    at the candidate post ids if given"""
+    fresh_index('posts', _search_index, _build_search_index)
+    term_scores = _bm25_term_scores if mode == 'bm25' else _basic_term_scores
+    
+    with _index_lock:
+        scores = None
+        for i, term in enumerate(query_terms):
+            # Later terms only need scoring for the posts still matching
+            matched = term_scores(_expand_term(term, prefix=i == len(query_terms) - 1),
+                                  candidates if scores is None else scores)
+            if scores is None:
+                scores = matched
+            else:
+                scores = Counter({pid: scores[pid] + n for pid, n in matched.items() if pid in scores})
+            if not scores:
+                break
+    return dict(scores)
+
+# Search result cache: {post_id: score} per (mode, normalized query), the
+# least recently used evicted beyond SEARCH_CACHE_SIZE entries and all of
+# them dropped when the posts change. Concurrent lookups of the same query
+# wait for a single computation. Every post matching a query also matches
+# the queries it extends ("pyth" and "python web" both extend "pyt"), so a
+# query with a cached shorter prefix only rescores the posts that matched it.
+SEARCH_CACHE_SIZE = 256
+
+_search_cache = {'entries': OrderedDict(), 'inflight': {}, 'generation': 0}
+_search_cache_lock = threading.Lock()
+
+def _clear_search_cache(*_):
+    with _search_cache_lock:
+        _search_cache['entries'].clear()
+        _search_cache['generation'] += 1
+
+register_index('posts', _search_cache, _clear_search_cache)
+
+def search_post_ids(query, mode='basic'):
+    """Return {post_id: score} for posts matching every term in the query.
+    
+    The last term matches as a prefix so the live search works while typing.
+    Results are shared with the search cache and must not be modified.
+    """
+    query_terms = tokenize(query)
+    if not query_terms:
+        return {}
+    fresh_index('posts', _search_cache, _clear_search_cache)
+    normalized = ' '.join(query_terms)
+    key = (mode, normalized)
+    
+    with _search_cache_lock:
+        entries = _search_cache['entries']
+        scores = entries.get(key)
+        if scores is not None:
+            entries.move_to_end(key)
+            return scores
+        pending = _search_cache['inflight'].get(key)
+        if pending is None:
+            pending = _search_cache['inflight'][key] = Future()
+            generation = _search_cache['generation']
+            prefixes = ((mode, normalized[:end]) for end in range(len(normalized) - 1, 0, -1))
+            candidates = next((entries[k] for k in prefixes if k in entries), None)
+        else:
+            generation = None
+    if generation is None:
+        return pending.result()
+    
+    try:
+        scores = _score_query(query_terms, mode, candidates)
+    except Exception as e:
+        with _search_cache_lock:
+            del _search_cache['inflight'][key]
+        pending.set_exception(e)
+        raise
+    with _search_cache_lock:
+        del _search_cache['inflight'][key]
+        if _search_cache['generation'] == generation:
+            entries[key] = scores
+            while len(entries) > SEARCH_CACHE_SIZE:
+                entries.popitem(last=False)
+    pending.set_result(scores)
+    return scores
+
+def top_search_results(query, limit, mode='basic'):
+    """The `limit` best (post_id, score) pairs, picked with a heap"""
+    scores = search_post_ids(query, mode)
+    return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+
+def search_snippet(post, query, length=SNIPPET_LENGTH):
+    """An escaped excerpt of the post centred on the densest run of query
+    matches, with the matches wrapped in <mark>"""
+    content = post.get('content', '')
+    query_terms = tokenize(query)
+    with _index_lock:
+        positions = _search_index['positions'].get(post['id'], {})
+        hits = []
+        for i, term in enumerate(query_terms):
+            if i == len(query_terms) - 1:
+                hits.extend((start, len(t)) for t, starts in positions.items()
+                            if t.startswith(term) for start in starts)
+            else:
+                hits.extend((start, len(term)) for start in positions.get(term, ()))
+    hits.sort()
+    
+    if not hits:
+        window_start = 0
+    else:
+        # Two-pointer scan for the window containing the most matches
+        best, best_count, j = 0, 0, 0
+        for i, (start, _) in enumerate(hits):
+            while hits[j][0] < start - length:
+                j += 1
+            if i - j + 1 > best_count:
+                best, best_count = j, i - j + 1
+        first, last = hits[best][0], hits[best + best_count - 1][0]
+        window_start = max(0, (first + last) // 2 - length // 2)
+        window_start = min(window_start, first)
+    window_end = min(len(content), window_start + length)
+    
+    parts = ['...' if window_start > 0 else '']
+    cursor = window_start
+    for start, size in hits:
+        if start < cursor or start + size > window_end:
             continue
-            
-        score = 0
-        # Category match
-        if p.get('category') == current_category:
-            score += 3
-        
-        # Tag matches
-        post_tags = set(p.get('tags', []))
-        common_tags = current_tags.intersection(post_tags)
-        score += len(common_tags) * 2
-        
-        if score > 0:
-            scored_posts.append((p, score))
+        parts.append(escape(content[cursor:start]))
+        parts.append(Markup('<mark>%s</mark>') % content[start:start + size])
+        cursor = start + size
+    parts.append(escape(content[cursor:window_end]))
+    parts.append('...' if window_end < len(content) else '')
+    return Markup('').join(parts)
+
+# Admin analytics and per-author statistics. Aggregates are maintained from
+# the view, comment and post writes instead of scanning the data on every
+# request: views per day, comments per day, the most recent comments, and
+# per-author post ids, views and comments received. Top posts and recent
+# posts come from the presorted listing orders and the category breakdown
+# from the category index.
+ADMIN_RECENT_ITEMS = 5
+ADMIN_TOP_ITEMS = 10
+
+# Author -> post ids, patched on post writes. The per-author view and comment
+# counters below are built against one generation of this index: a local
+# post write patches them along with it, while a rebuild (after another
+# worker's write) makes them rebuild too.
+_author_index = {'posts': {}, 'authors': {}, 'generation': 0}
+
+def _build_author_index():
+    posts, authors = {}, {}
+    for summary in get_post_summaries():
+        authors[summary['id']] = summary['author_id']
+        posts.setdefault(summary['author_id'], set()).add(summary['id'])
+    _author_index.update(posts=posts, authors=authors, generation=_author_index['generation'] + 1)
+
+def _update_author_index(post_id, post):
+    posts, authors = _author_index['posts'], _author_index['authors']
+    existed = post_id in authors
+    old_author = authors.pop(post_id, None)
+    if existed:
+        _discard_indexed(posts, old_author, post_id)
+    new_author = post.get('author_id') if post is not None else None
+    if post is not None:
+        authors[post_id] = new_author
+        posts.setdefault(new_author, set()).add(post_id)
+    if existed and (post is None or old_author != new_author):
+        # Move the post's views and comments over to its new author (if any)
+        for index, count in ((_admin_views, get_view_total), (_admin_comments, _admin_comments['per_post'].get)):
+            if index.get('generation') != _author_index['generation']:
+                continue
+            moved = count(post_id) or 0
+            index['per_author'][old_author] -= moved
+            if post is not None:
+                index['per_author'][new_author] += moved
+
+register_index('posts', _author_index, _update_author_index)
+
+_admin_views = {'per_day': Counter(), 'per_author': Counter()}
+
+def _build_admin_views():
+    since = _rollup_cutoffs()['hot']
+    per_day = Counter()
+    for _, day, count in get_daily_views(since):
+        per_day[day] += count
+    authors = fresh_index('posts', _author_index, _build_author_index)['authors']
+    per_author = Counter()
+    for post_id, total in get_view_totals().items():
+        if post_id in authors:
+            per_author[authors[post_id]] += total
+    _admin_views.update(per_day=per_day, per_author=per_author, generation=_author_index['generation'])
+
+def _update_admin_views(record_id, batch):
+    authors = _author_index['authors']
+    for (post_id, day), count in batch.items():
+        _admin_views['per_day'][day] += count
+        if post_id in authors:
+            _admin_views['per_author'][authors[post_id]] += count
+
+register_index('analytics', _admin_views, _update_admin_views)
+
+_admin_comments = {'per_day': Counter(), 'per_post': Counter(), 'per_author': Counter(),
+                   'recent': deque(maxlen=ADMIN_RECENT_ITEMS), 'max_id': 0}
+
+def _build_admin_comments():
+    comments = peek_collection('comments')
+    newest = heapq.nlargest(ADMIN_RECENT_ITEMS, comments, key=lambda c: (c['date'], c['id']))
+    per_post = Counter(c['post_id'] for c in comments)
+    authors = fresh_index('posts', _author_index, _build_author_index)['authors']
+    per_author = Counter()
+    for post_id, count in per_post.items():
+        if post_id in authors:
+            per_author[authors[post_id]] += count
+    _admin_comments.update(per_day=Counter(c['date'][:10] for c in comments),
+                           per_post=per_post, per_author=per_author,
+                           recent=deque((dict(c) for c in newest), maxlen=ADMIN_RECENT_ITEMS),
+                           max_id=max((c['id'] for c in comments), default=0),
+                           generation=_author_index['generation'], stale=False)
+
+def _update_admin_comments(comment_id, comment):
+    if comment is None or comment_id <= _admin_comments['max_id']:
+        # Deletes and edits can't be patched into the counts: rebuild on next use
+        _admin_comments['stale'] = True
+        return
+    post_id = comment['post_id']
+    _admin_comments['per_day'][comment['date'][:10]] += 1
+    _admin_comments['per_post'][post_id] += 1
+    if post_id in _author_index['authors']:
+        _admin_comments['per_author'][_author_index['authors'][post_id]] += 1
+    _admin_comments['recent'].appendleft(dict(comment))
+    _admin_comments['max_id'] = comment_id
+
+register_index('comments', _admin_comments, _update_admin_comments)
+
+def _fresh_author_counters():
+    fresh_index('posts', _author_index, _build_author_index)
+    for collection, index, build in (('analytics', _admin_views, _build_admin_views),
+                                     ('comments', _admin_comments, _build_admin_comments)):
+        if index.get('stale') or index.get('generation') != _author_index['generation']:
+            index['version'] = None
+        fresh_index(collection, index, build)
+
+def get_author_post_ids(author_id):
+    """Ids of an author's posts"""
+    fresh_index('posts', _author_index, _build_author_index)
+    with _index_lock:
+        return set(_author_index['posts'].get(author_id, ()))
+
+def get_author_stats(author_id):
+    """Post count, total and average views, and comments received by an author"""
+    _fresh_author_counters()
+    with _index_lock:
+        post_ids = set(_author_index['posts'].get(author_id, ()))
+        total_views = _admin_views['per_author'][author_id]
+        total_comments = _admin_comments['per_author'][author_id]
+    with _views_lock:
+        total_views += sum(count for post_id, count in _pending_view_totals.items() if post_id in post_ids)
+    return {'total_posts': len(post_ids),
+            'total_views': total_views,
+            'avg_views': round(total_views / len(post_ids)) if post_ids else 0,
+            'total_comments': total_comments}
+
+def count_records(collection):
+    """Number of records in a collection"""
+    if _use_sqlite():
+        return get_db().execute(f'SELECT COUNT(*) FROM {collection}').fetchone()[0]
+    return len(peek_data(_COLLECTION_FILES[collection]))
+
+def recent_comments():
+    """The ADMIN_RECENT_ITEMS newest comments, newest first"""
+    _fresh_author_counters()
+    with _index_lock:
+        return [dict(c) for c in _admin_comments['recent']]
+
+def _daily_series(per_day, days):
+    """[day, count] pairs for the last `days` days, oldest first"""
+    today = date.today()
+    days = [(today - timedelta(days=n)).isoformat() for n in range(days - 1, -1, -1)]
+    return [[day, per_day.get(day, 0)] for day in days]
+
+def admin_analytics(days=ANALYTICS_HOT_DAYS):
+    """Site-wide analytics for the admin dashboard and its JSON endpoint"""
+    _fresh_author_counters()
+    with _index_lock:
+        views_per_day = _daily_series(_admin_views['per_day'], days)
+        comments_per_day = _daily_series(_admin_comments['per_day'], days)
+        top_author_views = heapq.nlargest(
+            ADMIN_TOP_ITEMS, ((author_id, views) for author_id, views in _admin_views['per_author'].items()
+                              if author_id is not None and views > 0), key=lambda item: item[1])
+        author_posts = {author_id: len(_author_index['posts'].get(author_id, ()))
+                        for author_id, _ in top_author_views}
+    
+    top_ids, _, _ = listing_page('popular', ADMIN_TOP_ITEMS)
+    top_posts = [{'id': p['id'], 'title': p['title'], 'views': get_view_total(p['id'])}
+                 for p in get_post_summaries(top_ids)]
+    
+    authors = get_users_by_ids(author_id for author_id, _ in top_author_views)
+    top_authors = [{'id': author_id,
+                    'username': authors[author_id]['username'] if author_id in authors else 'Unknown User',
+                    'views': views,
+                    'posts': author_posts[author_id]}
+                   for author_id, views in top_author_views]
     
-    # Sort by score and return top posts
-    scored_posts.sort(key=lambda x: x[1], reverse=True)
-    return [p[0] for p in scored_posts[:limit]]
+    posts_per_category = category_counts()
+    categories = [{'slug': c['slug'], 'name': c['name'], 'posts': posts_per_category.get(c['slug'], 0)}
+                  for c in peek_collection('categories')]
+    categories.sort(key=lambda c: -c['posts'])
+    
+    return {'views_per_day': views_per_day,
+            'comments_per_day': comments_per_day,
+            'top_posts': top_posts,
+            'top_authors': top_authors,
+            'categories': categories}
+
+# Page cache. Template contexts are cached per route and query arguments and
+# shared by all viewers; the rendered HTML is additionally cached per viewer,
+# except when flash messages are pending. Every entry lists dependency tags
+# ('listing', 'categories', 'post:<id>', 'comments:<id>', 'views:<id>',
+# 'viewer:<user id>') that local writes invalidate. A write made by another worker changes the
+# collection version and clears the whole cache.
+_page_cache = OrderedDict()  # key -> (expires_at, deps, value)
+_page_cache_deps = {}  # dependency tag -> keys
+_page_cache_lock = threading.RLock()
+
+def _page_cache_get(key):
+    with _page_cache_lock:
+        entry = _page_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            _page_cache_discard(key)
+            return None
+        _page_cache.move_to_end(key)
+        return entry[2]
+
+def _page_cache_set(key, value, deps):
+    with _page_cache_lock:
+        _page_cache_discard(key)
+        _page_cache[key] = (time.time() + PAGE_CACHE_TTL, deps, value)
+        for dep in deps:
+            _page_cache_deps.setdefault(dep, set()).add(key)
+        while len(_page_cache) > PAGE_CACHE_SIZE:
+            _page_cache_discard(next(iter(_page_cache)))
 
-def search_posts(query, posts):
-    """Enhanced search with relevance scoring"""
-    if not query:
-        return posts
+def _page_cache_discard(key):
+    entry = _page_cache.pop(key, None)
+    if entry is not None:
+        for dep in entry[1]:
+            keys = _page_cache_deps.get(dep)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del _page_cache_deps[dep]
+
+def invalidate_pages(*deps):
+    """Drop cached pages depending on any of the given tags"""
+    with _page_cache_lock:
+        for dep in deps:
+            for key in list(_page_cache_deps.get(dep, ())):
+                _page_cache_discard(key)
+
+def clear_page_cache():
+    with _page_cache_lock:
+        _page_cache.clear()
+        _page_cache_deps.clear()
+
+_page_cache_versions = {name: {} for name in ('users', 'posts', 'comments', 'categories', 'analytics')}
+register_index('users', _page_cache_versions['users'],
+               lambda user_id, user: invalidate_pages(f'viewer:{user_id}'))
+register_index('posts', _page_cache_versions['posts'],
+               lambda post_id, post: invalidate_pages('listing', f'post:{post_id}'))
+register_index('comments', _page_cache_versions['comments'],
+               lambda comment_id, comment: invalidate_pages(f'comments:{comment["post_id"]}') if comment else None)
+register_index('categories', _page_cache_versions['categories'],
+               lambda category_id, category: invalidate_pages('categories'))
+register_index('analytics', _page_cache_versions['analytics'],
+               lambda record_id, batch: invalidate_pages('listing', *{f'views:{post_id}' for post_id, _ in batch}))
+
+def render_cached(template, key, build_context):
+    """Render a template from a cached context; build_context() returns
+    (context, deps), or None when the page does not exist"""
+    for collection, index in _page_cache_versions.items():
+        fresh_index(collection, index, clear_page_cache)
     
-    query_lower = query.lower()
-    scored_posts = []
+    # Pages with flash messages are rendered fresh and never stored
+    viewer_id = session.get('admin_id') or session.get('user_id')
+    viewer_key = key + (session.get('user_type'), viewer_id)
+    cache_html = '_flashes' not in session
+    if cache_html:
+        html = _page_cache_get(viewer_key)
+        if html is not None:
+            return html
     
-    for post in posts:
-        score = 0
-        
-        # Title matches (higher weight)
-        title_matches = len(re.findall(re.escape(query_lower), post['title'].lower()))
-        score += title_matches * 3
-        
-        # Content matches
-        content_matches = len(re.findall(re.escape(query_lower), post['content'].lower()))
-        score += content_matches
-        
-        # Tag matches
-        for tag in post.get('tags', []):
-            if query_lower in tag.lower():
-                score += 2
-        
-        # Category matches
-        if post.get('category') and query_lower in post['category'].lower():
-            score += 2
-        
-        if score > 0:
-            scored_posts.append((post, score))
+    cached = _page_cache_get(key)
+    if cached is None:
+        built = build_context()
+        if built is None:
+            return None
+        _page_cache_set(key, built, built[1])
+        cached = built
+    context, deps = cached
     
-    # Sort by relevance score
-    scored_posts.sort(key=lambda x: x[1], reverse=True)
-    return [p[0] for p in scored_posts]
+    html = render_template(template, **context)
+    if cache_html:
+        _page_cache_set(viewer_key, html, deps | {f'viewer:{viewer_id}'})
+    return html
 
 # Initialize default admin user
 def init_admin():
@@ -250,7 +2544,10 @@ def init_admin():
     else:
         # Update existing users to have required fields
         updated = False
-        for user in users:
+        for i, user in enumerate(users):
+            if all(field in user for field in ('bio', 'avatar', 'last_login')):
+                continue
+            user = users[i] = copy.deepcopy(user)
             if 'bio' not in user:
                 user['bio'] = 'Platform Administrator' if user.get('is_admin') else ''
                 updated = True
@@ -277,17 +2574,89 @@ def init_categories():
         ]
         save_categories(default_categories)
 
-@app.before_request
+# Move the totals and daily counts out of an analytics.json written before
+# they were kept in views.json
+def init_analytics():
+    if _use_sqlite():
+        return
+    with _file_lock(ANALYTICS_FILE), _file_lock(VIEWS_FILE):
+        if os.path.exists(VIEWS_FILE):
+            return
+        post_views = (peek_data(ANALYTICS_FILE) or {}).get('post_views', {})
+        if any('total' in entry or 'daily' in entry for entry in post_views.values()):
+            save_analytics(load_analytics())
+
 def initialize():
-    if not hasattr(app, '_initialized'):
-        init_admin()
-        init_categories()
-        app._initialized = True
+    """Create the default admin account and categories if they are missing,
+    and split a legacy analytics file"""
+    init_admin()
+    init_categories()
+    init_analytics()
+
+# Run once when the app is loaded rather than checked on every request
+initialize()
 
 @app.context_processor
 def inject_user():
     return dict(current_user=get_current_user())
 
+# Static URLs carry a hash of the file's contents (?v=...), so browsers
+# holding it for CACHE_CONTROL['static'] pick up a changed stylesheet
+_static_versions = {}  # filename -> (mtime, hash)
+
+@app.url_defaults
+def static_version(endpoint, values):
+    if endpoint != 'static' or 'filename' not in values:
+        return
+    path = os.path.join(app.static_folder, values['filename'])
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return
+    cached = _static_versions.get(values['filename'])
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = _static_versions[values['filename']] = (mtime, hashlib.sha1(f.read()).hexdigest()[:10])
+    values['v'] = cached[1]
+
+@app.after_request
+def static_cache_headers(response):
+    if request.endpoint == 'static':
+        response.headers['Cache-Control'] = CACHE_CONTROL['static']
+    return response
+
+def api_response(data):
+    """JSON response with a content ETag, answering conditional requests with 304"""
+    response = jsonify(data)
+    response.add_etag()
+    response.headers['Cache-Control'] = CACHE_CONTROL['api']
+    return response.make_conditional(request)
+
+def post_validators(post_id):
+    """(etag, last_modified) for a post page, or None if the post does not exist.
+    
+    The ETag covers everything the page shows: the post, its comments and
+    their authors, the related-post cards and the categories. It is built
+    from versions and the comment thread's size, so no comment is read.
+    Only flushed view counts go into it, matching the cached pages.
+    """
+    post = get_post(post_id)
+    if not post:
+        return None
+    thread = comment_thread_state(post_id)
+    viewer = (session.get('user_type'), session.get('admin_id') or session.get('user_id'))
+    related = [(p['id'], p.get('updated_at')) for p in get_related_posts(post, 3)]
+    state = (post_id, post.get('updated_at'), thread, get_view_total(post_id), viewer, related,
+             collection_version('users'), collection_version('categories'))
+    etag = hashlib.sha1(repr(state).encode()).hexdigest()
+    
+    last_change = max(post.get('updated_at') or post.get('date') or '', thread[1] or '')
+    try:
+        last_modified = datetime.strptime(last_change, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        last_modified = None
+    return etag, last_modified
+
 @app.route('/')
 def index():
     # Redirect based on user type
@@ -298,6 +2667,118 @@ def index():
     else:
         return redirect(url_for('login'))
 
+def filtered_post_ids(search, category, tag, sort_by, rank, limit=None):
+    """(post_ids, total) for the posts matching the search and filters: the
+    first `limit` ids in listing order (all of them without a limit) and the
+    number of matches.
+    
+    The matches are an intersection of the search results and the category
+    and tag indexes, smallest set first; they are then picked out of the
+    presorted listing order, so no post is loaded. Relevance pages are
+    picked with a heap.
+    """
+    matches = []
+    if search:
+        scores = search_post_ids(search, rank)
+        matches.append(set(scores))
+    if category:
+        matches.append(posts_in_category(category))
+    if tag:
+        matches.append(posts_with_tag(tag))
+    matches.sort(key=len)
+    matching = matches[0].intersection(*matches[1:]) if matches else None
+    
+    if sort_by == 'relevance' and search:
+        relevance = lambda i: (-scores[i], i)
+        if limit is None:
+            return sorted(matching, key=relevance), len(matching)
+        return heapq.nsmallest(limit, matching, key=relevance), len(matching)
+    if sort_by not in LISTING_SORTS:
+        sort_by = 'newest'
+    order = listing_order(sort_by)
+    with _index_lock:
+        keys = reversed(order) if sort_by == 'newest' else order
+        post_ids = list(itertools.islice((key[-1] for key in keys if matching is None or key[-1] in matching),
+                                         limit))
+        total = len(order) if matching is None else len(matching)
+    return post_ids, total
+
+def blog_page_context(page, search, category, tag, sort_by, rank):
+    """Template context for a /blog listing page and its cache dependencies"""
+    categories = peek_collection('categories')
+    start = (page - 1) * POSTS_PER_PAGE
+    
+    if not (search or category or tag) and sort_by in LISTING_SORTS:
+        # Unfiltered listings are read straight from the presorted orders
+        page_ids, _, total_posts = listing_page(sort_by, POSTS_PER_PAGE, offset=max(0, start))
+    else:
+        matching_ids, total_posts = filtered_post_ids(search, category, tag, sort_by, rank,
+                                                      limit=max(0, start) + POSTS_PER_PAGE)
+        page_ids = matching_ids[max(0, start):]
+    posts = get_post_summaries(page_ids)
+    total_pages = math.ceil(total_posts / POSTS_PER_PAGE)
+    
+    # Add view counts to posts
+    for post in posts:
+        try:
+            post['views'] = get_post_views(post.get('id', 0))
+            
+            # Ensure all posts have required fields
+            if 'tags' not in post:
+                post['tags'] = []
+            if 'category' not in post:
+                post['category'] = ''
+            if 'author_id' not in post:
+                post['author_id'] = None
+        except Exception as e:
+            print(f"Error processing post {post.get('id', 'unknown')}: {e}")
+            # Set default values
+            post['views'] = 0
+            post['reading_time'] = 1
+            post['excerpt'] = post.get('excerpt', '')
+            post['tags'] = post.get('tags', [])
+            post['category'] = post.get('category', '')
+            post['author_id'] = post.get('author_id')
+    
+    # Highlighted excerpts around the search matches
+    if search:
+        bodies = get_post_bodies(page_ids)
+        for post in posts:
+            post['snippet'] = search_snippet(dict(post, content=bodies.get(post['id'], '')), search)
+    
+    # Tags for the filter and the tag cloud, from the tag index
+    tags = tag_counts()
+    popular_tags = sorted(tags.items(), key=lambda item: (-item[1], item[0]))[:15]
+    posts_per_category = category_counts()
+    
+    # Get trending posts for sidebar
+    try:
+        trending_posts = get_post_summaries(get_trending_ids(SIDEBAR_TRENDING))
+        for tp in trending_posts:
+            tp['views'] = get_post_views(tp.get('id', 0))
+    except Exception as e:
+        print(f"Error getting trending posts: {e}")
+        trending_posts = []
+    
+    context = dict(posts=posts,
+                   categories=categories,
+                   all_tags=sorted(tags),
+                   popular_tags=popular_tags,
+                   category_counts=posts_per_category,
+                   current_page=page,
+                   total_pages=total_pages,
+                   search=search,
+                   selected_category=category,
+                   selected_tag=tag,
+                   sort_by=sort_by,
+                   rank=rank,
+                   trending_posts=trending_posts)
+    # 'listing' drops the page from the page cache on any post or view
+    # change; the finer tags let the static export skip unchanged pages
+    deps = {'listing', 'categories', 'taxonomy', 'trending'}
+    deps.update(f'{tag}:{post["id"]}' for post in posts + trending_posts for tag in ('post', 'views'))
+    return context, deps
+
 @app.route('/blog')
 @user_required
 def blog():
@@ -306,95 +2787,17 @@ def blog():
         search = request.args.get('search', '')
         category = request.args.get('category', '')
         tag = request.args.get('tag', '')
-        sort_by = request.args.get('sort', 'newest')  # newest, oldest, popular, trending
-        
-        posts = load_posts()
-        categories = load_categories()
+        rank = request.args.get('rank', 'basic')  # basic, bm25
+        if rank not in SEARCH_MODES:
+            rank = 'basic'
+        default_sort = 'relevance' if search and rank == 'bm25' else 'newest'
+        sort_by = request.args.get('sort', default_sort)  # newest, oldest, popular, trending, relevance
+        if sort_by not in LISTING_SORTS and not (sort_by == 'relevance' and search):
+            sort_by = 'newest'
         
-        # Enhanced search
-        if search:
-            posts = search_posts(search, posts)
-        
-        # Filter by category
-        if category:
-            posts = [p for p in posts if p.get('category') == category]
-        
-        # Filter by tag
-        if tag:
-            posts = [p for p in posts if tag in p.get('tags', [])]
-        
-        # Add view counts and reading time to posts
-        for post in posts:
-            try:
-                post['views'] = get_post_views(post.get('id', 0))
-                post['reading_time'] = get_reading_time(post.get('content', ''))
-                
-                # Ensure all posts have required fields
-                if 'tags' not in post:
-                    post['tags'] = []
-                if 'category' not in post:
-                    post['category'] = ''
-                if 'author_id' not in post:
-                    post['author_id'] = None
-            except Exception as e:
-                print(f"Error processing post {post.get('id', 'unknown')}: {e}")
-                # Set default values
-                post['views'] = 0
-                post['reading_time'] = 1
-                post['tags'] = post.get('tags', [])
-                post['category'] = post.get('category', '')
-                post['author_id'] = post.get('author_id')
-        
-        # Sort posts
-        if sort_by == 'oldest':
-            posts.sort(key=lambda x: x.get('date', ''))
-        elif sort_by == 'popular':
-            posts.sort(key=lambda x: x.get('views', 0), reverse=True)
-        elif sort_by == 'trending':
-            # Get trending post IDs
-            try:
-                trending = get_trending_posts(len(posts))
-                trending_ids = [p['id'] for p in trending]
-                posts.sort(key=lambda x: trending_ids.index(x['id']) if x['id'] in trending_ids else len(trending_ids))
-            except:
-                posts.sort(key=lambda x: x.get('date', ''), reverse=True)
-        else:  # newest (default)
-            posts.sort(key=lambda x: x.get('date', ''), reverse=True)
-        
-        # Pagination
-        total_posts = len(posts)
-        total_pages = math.ceil(total_posts / POSTS_PER_PAGE)
-        start = (page - 1) * POSTS_PER_PAGE
-        end = start + POSTS_PER_PAGE
-        posts = posts[start:end]
-        
-        # Get all tags for filter
-        all_posts = load_posts()
-        all_tags = set()
-        for post in all_posts:
-            all_tags.update(post.get('tags', []))
-        
-        # Get trending posts for sidebar
-        try:
-            trending_posts = get_trending_posts(5)
-            for tp in trending_posts:
-                tp['views'] = get_post_views(tp.get('id', 0))
-                tp['reading_time'] = get_reading_time(tp.get('content', ''))
-        except Exception as e:
-            print(f"Error getting trending posts: {e}")
-            trending_posts = []
-        
-        return render_template('index.html', 
-                             posts=posts, 
-                             categories=categories,
-                             all_tags=sorted(all_tags),
-                             current_page=page,
-                             total_pages=total_pages,
-                             search=search,
-                             selected_category=category,
-                             selected_tag=tag,
-                             sort_by=sort_by,
-                             trending_posts=trending_posts)
+        key = ('blog', page, search, category, tag, sort_by, rank)
+        return render_cached('index.html', key,
+                             lambda: blog_page_context(page, search, category, tag, sort_by, rank))
     
     except Exception as e:
         print(f"Error in blog route: {e}")
@@ -403,80 +2806,159 @@ def blog():
         flash(f'An error occurred: {str(e)}', 'error')
         return redirect(url_for('login'))
 
-@app.route('/post/<int:post_id>')
-def post_detail(post_id):
-    posts = load_posts()
-    post = next((p for p in posts if p['id'] == post_id), None)
+def post_page_context(post_id):
+    """Template context for a post page and its cache dependencies"""
+    post = get_post(post_id)
     if not post:
-        return "Post not found", 404
-    
-    # Track view
-    user_id = session.get('user_id')
-    track_view(post_id, user_id)
+        return None
     
     # Add metadata
     post['views'] = get_post_views(post_id)
-    post['reading_time'] = get_reading_time(post['content'])
+    with_content_html(with_post_metadata(post))
     
     # Get related posts
     related_posts = get_related_posts(post, 3)
     for rp in related_posts:
         rp['views'] = get_post_views(rp['id'])
-        rp['reading_time'] = get_reading_time(rp['content'])
     
-    comments = load_comments()
-    post_comments = [c for c in comments if c['post_id'] == post_id]
-    post_comments.sort(key=lambda x: x['date'])
+    post_comments = get_post_comments(post_id)
     
     # Add user info to comments
-    users = load_users()
+    authors = get_users_by_ids(c['author_id'] for c in post_comments)
     for comment in post_comments:
-        user = next((u for u in users if u['id'] == comment['author_id']), None)
+        with_content_html(comment)
+        user = authors.get(comment['author_id'])
         comment['author_name'] = user['username'] if user else 'Unknown User'
         comment['author_avatar'] = user.get('avatar', 'fas fa-user') if user else 'fas fa-user'
     
-    categories = load_categories()
+    categories = peek_collection('categories')
     category_name = next((c['name'] for c in categories if c['slug'] == post.get('category')), '')
     
-    return render_template('post.html', 
-                         post=post, 
-                         comments=post_comments, 
-                         category_name=category_name,
-                         related_posts=related_posts)
+    context = dict(post=post,
+                   comments=post_comments,
+                   category_name=category_name,
+                   related_posts=related_posts)
+    deps = {f'post:{post_id}', f'comments:{post_id}', f'views:{post_id}', 'categories'}
+    deps.update(f'post:{rp["id"]}' for rp in related_posts)
+    return context, deps
+
+@app.route('/post/<int:post_id>')
+def post_detail(post_id):
+    validators = post_validators(post_id)
+    if validators is None:
+        return "Post not found", 404
+    etag, last_modified = validators
+    
+    # Track view
+    user_id = session.get('user_id')
+    track_view(post_id, user_id)
+    
+    # Pages carrying flash messages are always sent in full
+    if '_flashes' in session:
+        response = make_response(render_cached('post.html', ('post', post_id),
+                                               lambda: post_page_context(post_id)))
+    else:
+        response = make_response('')
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.make_conditional(request)
+        if response.status_code != 304:
+            response.set_data(render_cached('post.html', ('post', post_id),
+                                            lambda: post_page_context(post_id)))
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = CACHE_CONTROL['post']
+    response.vary.add('Cookie')
+    return response
 
 @app.route('/api/posts/trending')
 @user_required
 def api_trending_posts():
     """API endpoint for trending posts"""
+    return api_response(trending_posts_data())
+
+def trending_posts_data():
     trending = get_trending_posts(10)
     for post in trending:
         post['views'] = get_post_views(post['id'])
-        post['reading_time'] = get_reading_time(post['content'])
-    
-    return jsonify(trending)
+        with_post_metadata(post)
+    return trending
 
 @app.route('/api/search')
 @user_required
 def api_search():
     """API endpoint for live search"""
     query = request.args.get('q', '')
+    mode = request.args.get('rank', 'basic')
+    if mode not in SEARCH_MODES:
+        mode = 'basic'
+    return api_response(search_results_data(query, mode))
+
+def search_results_data(query, mode):
     if len(query) < 2:
-        return jsonify([])
+        return []
     
-    posts = load_posts()
-    results = search_posts(query, posts)[:5]  # Limit to 5 results
+    top = top_search_results(query, 5, mode)  # Limit to 5 results
+    top_ids = [post_id for post_id, _ in top]
+    position = {post_id: i for i, post_id in enumerate(top_ids)}
+    results = sorted(get_posts_by_ids(top_ids), key=lambda p: position[p['id']])
+    scores = dict(top)
     
     search_results = []
     for post in results:
         search_results.append({
             'id': post['id'],
             'title': post['title'],
-            'excerpt': post['content'][:100] + '...' if len(post['content']) > 100 else post['content'],
+            'excerpt': with_post_metadata(post)['excerpt'],
+            'snippet': str(search_snippet(post, query)),
+            'score': round(scores[post['id']], 3),
+            'category': post.get('category', ''),
+            'url': url_for('post_detail', post_id=post['id'])
+        })
+    
+    return search_results
+
+@app.route('/api/posts')
+@user_required
+def api_posts():
+    """API endpoint for cursor-paginated posts (infinite scroll)"""
+    sort_by = request.args.get('sort', 'newest')
+    if sort_by not in LISTING_SORTS:
+        sort_by = 'newest'
+    limit = max(1, min(request.args.get('limit', POSTS_PER_PAGE, type=int), 50))
+    cursor = request.args.get('cursor')
+    
+    try:
+        after = decode_cursor(cursor, sort_by) if cursor else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return api_response(posts_page_data(sort_by, limit, after))
+
+def posts_page_data(sort_by, limit, after=None):
+    """One page of the /api/posts listing, after the given listing key"""
+    page_ids, last_key, total = listing_page(sort_by, limit, after=after)
+    posts = get_post_summaries(page_ids)
+    
+    results = []
+    for post in posts:
+        results.append({
+            'id': post['id'],
+            'title': post['title'],
+            'excerpt': post['excerpt'],
             'category': post.get('category', ''),
+            'tags': post.get('tags', []),
+            'date': post.get('date'),
+            'views': get_post_views(post['id']),
+            'reading_time': post['reading_time'],
             'url': url_for('post_detail', post_id=post['id'])
         })
     
-    return jsonify(search_results)
+    return {
+        'posts': results,
+        'total': total,
+        'next_cursor': encode_cursor(sort_by, last_key)
+    }
 
 @app.route('/user/dashboard')
 @user_required
@@ -503,14 +2985,12 @@ def profile():
             flash('User not found.', 'error')
             return redirect(url_for('login'))
         
-        posts = load_posts()
-        user_posts = [p for p in posts if p.get('author_id') == user.get('id')]
+        user_posts = get_author_summaries(user.get('id'))
         
         # Add metadata to user posts
         for post in user_posts:
             try:
                 post['views'] = get_post_views(post.get('id', 0))
-                post['reading_time'] = get_reading_time(post.get('content', ''))
                 
                 # Ensure required fields
                 if 'tags' not in post:
@@ -521,23 +3001,15 @@ def profile():
                 print(f"Error processing user post {post.get('id', 'unknown')}: {e}")
                 post['views'] = 0
                 post['reading_time'] = 1
+                post['excerpt'] = post.get('excerpt', '')
                 post['tags'] = post.get('tags', [])
                 post['category'] = post.get('category', '')
         
         user_posts.sort(key=lambda x: x.get('date', ''), reverse=True)
         
         # User statistics
-        try:
-            total_views = sum(get_post_views(p.get('id', 0)) for p in user_posts)
-        except:
-            total_views = 0
-        
-        stats = {
-            'total_posts': len(user_posts),
-            'total_views': total_views,
-            'avg_views': round(total_views / len(user_posts)) if user_posts else 0,
-            'joined_date': user.get('created_at', 'Unknown')
-        }
+        stats = get_author_stats(user.get('id'))
+        stats['joined_date'] = user.get('created_at', 'Unknown')
         
         return render_template('profile.html', user=user, posts=user_posts, stats=stats)
     
@@ -557,18 +3029,13 @@ def admin_profile():
             flash('Admin not found.', 'error')
             return redirect(url_for('admin_login'))
         
-        posts = load_posts()
-        users = load_users()
-        comments = load_comments()
-        
         # Admin statistics
-        admin_posts = [p for p in posts if p.get('author_id') == user.get('id')]
+        admin_posts = get_author_summaries(user.get('id'))
         
         # Add metadata to admin posts
         for post in admin_posts:
             try:
                 post['views'] = get_post_views(post.get('id', 0))
-                post['reading_time'] = get_reading_time(post.get('content', ''))
                 
                 # Ensure required fields
                 if 'tags' not in post:
@@ -579,26 +3046,18 @@ def admin_profile():
                 print(f"Error processing admin post {post.get('id', 'unknown')}: {e}")
                 post['views'] = 0
                 post['reading_time'] = 1
+                post['excerpt'] = post.get('excerpt', '')
                 post['tags'] = post.get('tags', [])
                 post['category'] = post.get('category', '')
         
         admin_posts.sort(key=lambda x: x.get('date', ''), reverse=True)
         
         # Admin-specific statistics
-        try:
-            total_views = sum(get_post_views(p.get('id', 0)) for p in admin_posts)
-        except:
-            total_views = 0
-        
-        stats = {
-            'total_posts': len(admin_posts),
-            'total_views': total_views,
-            'avg_views': round(total_views / len(admin_posts)) if admin_posts else 0,
-            'joined_date': user.get('created_at', 'Unknown'),
-            'total_users': len(users),
-            'total_platform_posts': len(posts),
-            'total_comments': len(comments)
-        }
+        stats = get_author_stats(user.get('id'))
+        stats.update(joined_date=user.get('created_at', 'Unknown'),
+                     total_users=count_records('users'),
+                     total_platform_posts=count_records('posts'),
+                     total_comments=count_records('comments'))
         
         return render_template('admin_profile.html', user=user, posts=admin_posts, stats=stats)
     
@@ -615,21 +3074,21 @@ def edit_profile():
     user = get_current_user()
     
     if request.method == 'POST':
-        users = load_users()
-        user_index = next(i for i, u in enumerate(users) if u['id'] == user['id'])
+        updated = get_user(user['id'])
         
-        users[user_index]['bio'] = request.form.get('bio', '')
-        users[user_index]['avatar'] = request.form.get('avatar', 'fas fa-user')
+        updated['bio'] = request.form.get('bio', '')
+        updated['avatar'] = request.form.get('avatar', 'fas fa-user')
         
         # Update email if changed and not taken
         new_email = request.form.get('email')
         if new_email != user['email']:
-            if any(u['email'] == new_email and u['id'] != user['id'] for u in users):
+            existing = get_user_by_email(new_email)
+            if existing and existing['id'] != user['id']:
                 flash('Email already in use.', 'error')
                 return render_template('edit_profile.html', user=user)
-            users[user_index]['email'] = new_email
+            updated['email'] = new_email
         
-        save_users(users)
+        update_user(updated)
         flash('Profile updated successfully!', 'success')
         return redirect(url_for('profile'))
     
@@ -641,21 +3100,21 @@ def edit_admin_profile():
     user = get_current_user()
     
     if request.method == 'POST':
-        users = load_users()
-        user_index = next(i for i, u in enumerate(users) if u['id'] == user['id'])
+        updated = get_user(user['id'])
         
-        users[user_index]['bio'] = request.form.get('bio', '')
-        users[user_index]['avatar'] = request.form.get('avatar', 'fas fa-user-shield')
+        updated['bio'] = request.form.get('bio', '')
+        updated['avatar'] = request.form.get('avatar', 'fas fa-user-shield')
         
         # Update email if changed and not taken
         new_email = request.form.get('email')
         if new_email != user['email']:
-            if any(u['email'] == new_email and u['id'] != user['id'] for u in users):
+            existing = get_user_by_email(new_email)
+            if existing and existing['id'] != user['id']:
                 flash('Email already in use.', 'error')
                 return render_template('admin_edit_profile.html', user=user)
-            users[user_index]['email'] = new_email
+            updated['email'] = new_email
         
-        save_users(users)
+        update_user(updated)
         flash('Admin profile updated successfully!', 'success')
         return redirect(url_for('admin_profile'))
     
@@ -668,16 +3127,12 @@ def register():
         email = request.form['email']
         password = request.form['password']
         
-        users = load_users()
-        
         # Check if user exists
-        if any(u['username'] == username or u['email'] == email for u in users):
+        if get_user_by_username(username) or get_user_by_email(email):
             flash('Username or email already exists.', 'error')
             return render_template('register.html')
         
-        new_id = max([u['id'] for u in users], default=0) + 1
         user = {
-            'id': new_id,
             'username': username,
             'email': email,
             'password': generate_password_hash(password),
@@ -685,8 +3140,7 @@ def register():
             'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
         
-        users.append(user)
-        save_users(users)
+        insert_user(user)
         
         flash('Registration successful! Please log in.', 'success')
         return redirect(url_for('login'))
@@ -704,8 +3158,9 @@ def admin_login():
         username = request.form['username']
         password = request.form['password']
         
-        users = load_users()
-        user = next((u for u in users if u['username'] == username and u.get('is_admin', False)), None)
+        user = get_user_by_username(username)
+        if user and not user.get('is_admin', False):
+            user = None
         
         if user and check_password_hash(user['password'], password):
             session['admin_id'] = user['id']
@@ -721,7 +3176,7 @@ def admin_login():
             
             # Update last login
             user['last_login'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            save_users(users)
+            update_user(user)
             
             flash('Admin login successful!', 'success')
             return redirect(url_for('admin_dashboard'))
@@ -736,8 +3191,9 @@ def user_login():
         username = request.form['username']
         password = request.form['password']
         
-        users = load_users()
-        user = next((u for u in users if u['username'] == username and not u.get('is_admin', False)), None)
+        user = get_user_by_username(username)
+        if user and user.get('is_admin', False):
+            user = None
         
         if user and check_password_hash(user['password'], password):
             session['user_id'] = user['id']
@@ -753,7 +3209,7 @@ def user_login():
             
             # Update last login
             user['last_login'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            save_users(users)
+            update_user(user)
             
             flash('Login successful!', 'success')
             return redirect(url_for('user_dashboard'))
@@ -785,9 +3241,6 @@ def user_logout():
 @login_required
 def new_post():
     if request.method == 'POST':
-        posts = load_posts()
-        new_id = max([p['id'] for p in posts], default=0) + 1
-        
         tags = [tag.strip() for tag in request.form['tags'].split(',') if tag.strip()]
         
         # Get the current user ID (works for both admin and user sessions)
@@ -797,7 +3250,6 @@ def new_post():
             return redirect(url_for('login'))
         
         post = {
-            'id': new_id,
             'title': request.form['title'],
             'content': request.form['content'],
             'category': request.form['category'],
@@ -807,19 +3259,17 @@ def new_post():
             'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
         
-        posts.append(post)
-        save_posts(posts)
+        new_id = insert_post(post)
         flash('Post created successfully!', 'success')
         return redirect(url_for('post_detail', post_id=new_id))
     
-    categories = load_categories()
+    categories = peek_collection('categories')
     return render_template('new_post.html', categories=categories)
 
 @app.route('/edit/<int:post_id>', methods=['GET', 'POST'])
 @login_required
 def edit_post(post_id):
-    posts = load_posts()
-    post = next((p for p in posts if p['id'] == post_id), None)
+    post = get_post(post_id)
     
     if not post:
         flash('Post not found.', 'error')
@@ -839,18 +3289,17 @@ def edit_post(post_id):
         post['tags'] = [tag.strip() for tag in request.form['tags'].split(',') if tag.strip()]
         post['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
-        save_posts(posts)
+        update_post(post)
         flash('Post updated successfully!', 'success')
         return redirect(url_for('post_detail', post_id=post_id))
     
-    categories = load_categories()
+    categories = peek_collection('categories')
     return render_template('edit_post.html', post=post, categories=categories)
 
 @app.route('/delete/<int:post_id>')
 @login_required
 def delete_post(post_id):
-    posts = load_posts()
-    post = next((p for p in posts if p['id'] == post_id), None)
+    post = get_post(post_id)
     
     if not post:
         flash('Post not found.', 'error')
@@ -863,13 +3312,8 @@ def delete_post(post_id):
         flash('You can only delete your own posts.', 'error')
         return redirect(url_for('post_detail', post_id=post_id))
     
-    posts.remove(post)
-    save_posts(posts)
-    
-    # Delete associated comments
-    comments = load_comments()
-    comments = [c for c in comments if c['post_id'] != post_id]
-    save_comments(comments)
+    # Deletes the associated comments as well
+    remove_post(post_id)
     
     flash('Post deleted successfully!', 'success')
     return redirect(url_for('blog'))
@@ -885,19 +3329,16 @@ def add_comment(post_id):
         flash('Session expired. Please log in again.', 'error')
         return redirect(url_for('login'))
     
-    comments = load_comments()
-    new_id = max([c['id'] for c in comments], default=0) + 1
-    
     comment = {
-        'id': new_id,
         'post_id': post_id,
         'author_id': current_user['id'],
         'content': content,
-        'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'submission_id': os.urandom(16).hex()
     }
     
-    comments.append(comment)
-    save_comments(comments)
+    # Stored by the background worker
+    enqueue_job('comment', comment, wake=True)
     
     flash('Comment added successfully!', 'success')
     return redirect(url_for('post_detail', post_id=post_id))
@@ -905,42 +3346,68 @@ def add_comment(post_id):
 @app.route('/admin')
 @admin_required
 def admin_dashboard():
-    posts = load_posts()
-    users = load_users()
-    comments = load_comments()
-    categories = load_categories()
+    recent_ids, _, total_posts = listing_page('newest', ADMIN_RECENT_ITEMS)
     
     stats = {
-        'total_posts': len(posts),
-        'total_users': len(users),
-        'total_comments': len(comments),
-        'total_categories': len(categories)
+        'total_posts': total_posts,
+        'total_users': count_records('users'),
+        'total_comments': count_records('comments'),
+        'total_categories': count_records('categories')
     }
     
-    recent_posts = sorted(posts, key=lambda x: x['date'], reverse=True)[:5]
-    recent_comments = sorted(comments, key=lambda x: x['date'], reverse=True)[:5]
+    recent_posts = get_post_summaries(recent_ids)
     
     return render_template('admin/dashboard.html', 
                          stats=stats, 
                          recent_posts=recent_posts, 
-                         recent_comments=recent_comments)
+                         recent_comments=recent_comments())
+
+@app.route('/admin/analytics')
+@admin_required
+def admin_analytics_page():
+    return render_template('admin/analytics.html', analytics=admin_analytics())
+
+@app.route('/admin/api/analytics')
+@admin_required
+def api_admin_analytics():
+    """API endpoint for the admin analytics"""
+    return api_response(admin_analytics())
+
+@app.route('/admin/api/analytics/post/<int:post_id>')
+@admin_required
+def api_admin_post_views(post_id):
+    """View history of a post: daily, weekly and monthly buckets starting
+    between the optional `start` and `end` dates (YYYY-MM-DD)"""
+    start, end = request.args.get('start'), request.args.get('end')
+    try:
+        for day in (start, end):
+            if day:
+                date.fromisoformat(day)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    history = get_view_history(post_id, start, end)
+    return api_response({
+        'post_id': post_id,
+        'total': get_view_total(post_id),
+        'history': [{'start': s, 'period': period, 'views': count} for s, period, count in history],
+    })
 
 @app.route('/admin/users')
 @admin_required
 def admin_users():
-    users = load_users()
+    users = peek_collection('users')
     return render_template('admin/users.html', users=users)
 
 @app.route('/admin/posts')
 @admin_required
 def admin_posts():
-    posts = load_posts()
-    users = load_users()
+    posts = get_post_summaries()
+    authors = get_users_by_ids(p.get('author_id') for p in posts)
     
     # Add author names to posts
     for post in posts:
         if post.get('author_id'):
-            author = next((u for u in users if u['id'] == post['author_id']), None)
+            author = authors.get(post['author_id'])
             post['author_name'] = author['username'] if author else 'Unknown User'
         else:
             post['author_name'] = 'Legacy Post'
@@ -952,30 +3419,383 @@ def admin_posts():
 @admin_required
 def admin_categories():
     if request.method == 'POST':
-        categories = load_categories()
-        new_id = max([c['id'] for c in categories], default=0) + 1
-        
         category = {
-            'id': new_id,
             'name': request.form['name'],
             'slug': request.form['name'].lower().replace(' ', '-')
         }
         
-        categories.append(category)
-        save_categories(categories)
+        insert_category(category)
         flash('Category added successfully!', 'success')
     
-    categories = load_categories()
+    categories = peek_collection('categories')
     return render_template('admin/categories.html', categories=categories)
 
 @app.route('/admin/delete_category/<int:category_id>')
 @admin_required
 def delete_category(category_id):
-    categories = load_categories()
-    categories = [c for c in categories if c['id'] != category_id]
-    save_categories(categories)
+    remove_category(category_id)
     flash('Category deleted successfully!', 'success')
     return redirect(url_for('admin_categories'))
 
+# ASGI entry point: `uvicorn app:asgi_app`, or under gunicorn with
+# `-k uvicorn.workers.UvicornWorker`. The read-only JSON endpoints (search,
+# trending and the posts list) are answered on the event loop: their storage
+# reads run in a thread through asyncio.to_thread, and identical concurrent
+# requests await one shared computation. The Flask session cookie is
+# verified as in the WSGI app. Every other request, and API requests without
+# a user session, are handed to the Flask app in a thread.
+_asgi_inflight = {}  # coalescing key -> task computing the response body
+
+def _asgi_api_call(path, args):
+    """(coalescing key, function, arguments) of a request the event loop
+    answers itself, or None to leave it to Flask"""
+    def arg(name, default=''):
+        return args.get(name, [default])[0]
+    
+    if path == '/api/search':
+        mode = arg('rank', 'basic')
+        if mode not in SEARCH_MODES:
+            mode = 'basic'
+        return ('search', arg('q'), mode), search_results_data, (arg('q'), mode)
+    if path == '/api/posts/trending':
+        return ('trending',), trending_posts_data, ()
+    if path == '/api/posts':
+        sort_by = arg('sort', 'newest')
+        if sort_by not in LISTING_SORTS:
+            sort_by = 'newest'
+        try:
+            limit = max(1, min(int(arg('limit', POSTS_PER_PAGE)), 50))
+        except ValueError:
+            limit = POSTS_PER_PAGE
+        cursor = arg('cursor')
+        try:
+            after = decode_cursor(cursor, sort_by) if cursor else None
+        except ValueError:
+            return None  # Flask answers with the error
+        return ('posts', sort_by, limit, cursor), posts_page_data, (sort_by, limit, after)
+    return None
+
+def _asgi_session(headers):
+    """The Flask session of a request, empty if missing or tampered with"""
+    cookie = parse_cookie(headers.get('cookie', '')).get(app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return {}
+    serializer = app.session_interface.get_signing_serializer(app)
+    try:
+        return serializer.loads(cookie, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+def _asgi_compute(func, args):
+    with app.test_request_context('/'):
+        return app.json.dumps(func(*args)).encode('utf-8')
+
+async def _asgi_coalesced(key, func, args):
+    task = _asgi_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(asyncio.to_thread(_asgi_compute, func, args))
+        _asgi_inflight[key] = task
+        task.add_done_callback(lambda _: _asgi_inflight.pop(key, None))
+    # A client that disconnects must not cancel the computation for the others
+    return await asyncio.shield(task)
+
+def _call_wsgi(scope, body):
+    """Run a request through the Flask app; returns (status, headers, body)"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]}, {value}' if key in environ else value
+    
+    response = []
+    def start_response(status, headers, exc_info=None):
+        response[:] = [status, headers]
+    result = app(environ, start_response)
+    try:
+        data = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return int(response[0].split()[0]), response[1], data
+
+async def _asgi_send(send, status, headers, body):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def asgi_app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await asyncio.to_thread(drain_jobs)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    
+    headers = {}
+    for name, value in scope['headers']:
+        headers.setdefault(name.decode('latin-1').lower(), value.decode('latin-1'))
+    call = None
+    if scope['method'] in ('GET', 'HEAD'):
+        args = parse_qs(scope['query_string'].decode('latin-1'), keep_blank_values=True)
+        call = _asgi_api_call(scope['path'], args)
+    if call is not None:
+        session_data = _asgi_session(headers)
+        if 'user_id' in session_data and session_data.get('user_type') == 'user':
+            key, func, func_args = call
+            body = await _asgi_coalesced(key, func, func_args)
+            etag = generate_etag(body)
+            response_headers = [('Content-Type', 'application/json'),
+                                ('ETag', f'"{etag}"'),
+                                ('Cache-Control', CACHE_CONTROL['api']),
+                                ('Vary', 'Cookie')]
+            if parse_etags(headers.get('if-none-match')).contains(etag):
+                await _asgi_send(send, 304, response_headers, b'')
+            else:
+                response_headers.append(('Content-Length', str(len(body))))
+                await _asgi_send(send, 200, response_headers,
+                                 b'' if scope['method'] == 'HEAD' else body)
+            return
+    
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    status, response_headers, data = await asyncio.to_thread(_call_wsgi, scope, body)
+    await _asgi_send(send, status, response_headers, data)
+
+# Static export. Public pages and JSON endpoints are rendered, as an anonymous
+# visitor sees them, to files a front-end server can serve directly:
+#   post/<id>.html                                   /post/<id>
+#   blog/<sort>/<category|_>/<tag|_>/<page>.html     /blog?sort=&category=&tag=&page=
+#   api/posts/trending.json                          /api/posts/trending
+#   api/posts/sort/<sort>.json                       /api/posts?sort= (first page)
+# The manifest keeps each page's dependency tags and a fingerprint of the
+# data behind every tag. Listing pages and API files depend on the posts
+# they show ('post:<id>', 'views:<id>') and on 'page:<path>', the ids they
+# list in order plus the page count, so a view or an edit only re-renders
+# the pages showing that post or whose order changed. A later export only
+# re-renders the pages whose tags changed, and removes the pages that no
+# longer exist. Rendering is CPU-bound, so pages are split between
+# EXPORT_WORKERS forked processes where fork is available.
+EXPORT_MANIFEST = 'manifest.json'
+
+def _export_pages(summaries):
+    """Path -> (kind, args, shown) of every page to export; `shown` is what
+    the page lists, fingerprinted as its 'page:<path>' tag"""
+    pages = {f'post/{post["id"]}.html': ('post', post['id'], None) for post in summaries}
+    filters = [('', '')] + [(c['slug'], '') for c in peek_collection('categories')]
+    filters += [('', tag) for tag in tag_counts()]
+    for sort_by in LISTING_SORTS:
+        for category, tag in filters:
+            post_ids, _ = filtered_post_ids('', category, tag, sort_by, 'basic')
+            total_pages = math.ceil(len(post_ids) / POSTS_PER_PAGE)
+            folder = f'blog/{sort_by}/{quote(category, safe="") or "_"}/{quote(tag, safe="") or "_"}'
+            for page in range(1, max(1, total_pages) + 1):
+                start = (page - 1) * POSTS_PER_PAGE
+                pages[f'{folder}/{page}.html'] = ('blog', (page, category, tag, sort_by),
+                                                  (post_ids[start:start + POSTS_PER_PAGE], total_pages))
+        pages[f'api/posts/sort/{sort_by}.json'] = ('api-posts', sort_by,
+                                                   listing_page(sort_by, POSTS_PER_PAGE))
+    pages['api/posts/trending.json'] = ('api-trending', None, get_trending_ids(10))
+    return pages
+
+def _export_fingerprints(summaries, pages):
+    """Dependency tag -> fingerprint of the data behind it"""
+    def digest(value):
+        return hashlib.sha1(repr(value).encode()).hexdigest()
+    views = get_view_totals()
+    fingerprints = {
+        'categories': digest(peek_collection('categories')),
+        'taxonomy': digest((sorted(category_counts().items()), sorted(tag_counts().items()))),
+        'trending': digest(get_trending_ids(SIDEBAR_TRENDING)),
+    }
+    for post in summaries:
+        post_id = post['id']
+        fingerprints[f'post:{post_id}'] = digest(post)
+        fingerprints[f'comments:{post_id}'] = digest(comment_thread_state(post_id))
+        fingerprints[f'views:{post_id}'] = views.get(post_id, 0)
+    for path, (_, _, shown) in pages.items():
+        if shown is not None:
+            fingerprints[f'page:{path}'] = digest(shown)
+    return fingerprints
+
+def _render_export_page(kind, args):
+    """Body and dependency tags of an exported page"""
+    if kind == 'post':
+        context, deps = post_page_context(args)
+        return render_template('post.html', **context), deps
+    if kind == 'blog':
+        page, category, tag, sort_by = args
+        context, deps = blog_page_context(page, '', category, tag, sort_by, 'basic')
+        return render_template('index.html', **context), deps
+    if kind == 'api-posts':
+        data = posts_page_data(args, POSTS_PER_PAGE)
+        posts = data['posts']
+    else:
+        data = posts = trending_posts_data()
+    deps = {f'{tag}:{post["id"]}' for post in posts for tag in ('post', 'views')}
+    return jsonify(data).get_data(as_text=True), deps
+
+def _write_export_file(filename, body):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(body)
+    os.replace(filename + '.tmp', filename)
+
+def _export_page(output_dir, path, kind, args):
+    """Render one page to its file; returns (path, dependency tags)"""
+    with app.test_request_context('/'):
+        body, deps = _render_export_page(kind, args)
+    _write_export_file(os.path.join(output_dir, path), body)
+    if kind != 'post':
+        deps.add(f'page:{path}')
+    return path, sorted(deps)
+
+def export_static(output_dir=EXPORT_DIR, workers=EXPORT_WORKERS, full=False):
+    """Render the public pages to output_dir, re-rendering only those whose
+    dependencies changed since the last export (every page if full).
+    Returns (pages rendered, pages removed, total pages)."""
+    summaries = get_post_summaries()
+    pages = _export_pages(summaries)
+    fingerprints = _export_fingerprints(summaries, pages)
+    
+    manifest_file = os.path.join(output_dir, EXPORT_MANIFEST)
+    previous = {'fingerprints': {}, 'pages': {}}
+    if not full and os.path.exists(manifest_file):
+        try:
+            with open(manifest_file, encoding='utf-8') as f:
+                previous = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading {manifest_file}, exporting every page: {e}")
+    old_fingerprints = previous['fingerprints']
+    changed = {tag for tag in fingerprints.keys() | old_fingerprints.keys()
+               if fingerprints.get(tag) != old_fingerprints.get(tag)}
+    stale = [path for path in pages
+             if path not in previous['pages'] or changed.intersection(previous['pages'][path])
+             or not os.path.exists(os.path.join(output_dir, path))]
+    
+    page_deps = {path: deps for path, deps in previous['pages'].items() if path in pages}
+    jobs = [(output_dir, path) + pages[path][:2] for path in stale]
+    if workers > 1 and len(jobs) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        # One page of each kind is rendered here first, so the indexes the
+        # pages read are built once and inherited by the forked workers
+        first = {job[2]: job for job in reversed(jobs)}
+        page_deps.update(_export_page(*job) for job in first.values())
+        rest = [job for job in jobs if job not in first.values()]
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            chunksize = max(1, len(rest) // (workers * 4))
+            page_deps.update(pool.map(_export_page, *zip(*rest), chunksize=chunksize) if rest else ())
+    else:
+        page_deps.update(_export_page(*job) for job in jobs)
+    
+    removed = [path for path in previous['pages'] if path not in pages]
+    for path in removed:
+        try:
+            os.remove(os.path.join(output_dir, path))
+        except FileNotFoundError:
+            pass
+    _write_export_file(manifest_file, json.dumps({'fingerprints': fingerprints, 'pages': page_deps}))
+    return len(stale), len(removed), len(pages)
+
+@app.cli.command('migrate-json')
+def migrate_json():
+    """Import the JSON data files into the SQLite database"""
+    for table, filename in (('users', USERS_FILE), ('posts', POSTS_FILE),
+                            ('comments', COMMENTS_FILE), ('categories', CATEGORIES_FILE)):
+        records = [_read_stored_text(record) for record in peek_data(filename)]
+        _sql_replace_all(table, records)
+        print(f'Imported {len(records)} {table} from {filename}')
+    _sql_save_analytics(_file_analytics())
+    print(f'Imported view counts from {VIEWS_FILE} and {ANALYTICS_FILE} into {SQLITE_DB}')
+
+@app.cli.command('rollup-analytics')
+def rollup_analytics_command():
+    """Fold old daily view counts into weekly and monthly buckets"""
+    drain_jobs()
+    folded = rollup_views()
+    print(f'Rolled up {folded} view buckets in {SQLITE_DB if _use_sqlite() else ANALYTICS_FILE}')
+
+@app.cli.command('compute-similarity')
+def compute_similarity_command():
+    """Precompute content similarity between posts for related-post scoring"""
+    similarity = compute_similarity(peek_collection('posts'))
+    save_data(SIMILARITY_FILE, similarity)
+    print(f'Wrote similarity scores for {len(similarity)} posts to {SIMILARITY_FILE}')
+
+@app.cli.command('compact-logs')
+def compact_logs_command():
+    """Fold the users, posts and comments change logs into their snapshots"""
+    for filename in CHANGE_LOG_FILES:
+        compact_log(filename)
+        print(f'Compacted {filename}')
+
+@app.cli.command('convert-data')
+@click.argument('data_format', type=click.Choice(DATA_FORMATS))
+def convert_data_command(data_format):
+    """Rewrite the data files in another on-disk format"""
+    for filename in list(_COLLECTION_FILES.values()) + [ANALYTICS_FILE, SIMILARITY_FILE]:
+        if os.path.exists(filename):
+            compact_log(filename, data_format)
+            print(f'Converted {filename} to {data_format}')
+
+@app.cli.command('backfill-metadata')
+def backfill_metadata_command():
+    """Store the derived fields (word count, reading time, excerpt, rendered
+    HTML, content hash) on posts and comments saved before they existed or
+    edited outside the app, or computed by an older version of the app"""
+    posts = load_posts()
+    stale = []
+    for i, post in enumerate(posts):
+        metadata = post_metadata(post.get('content', ''))
+        if any(post.get(field) != value for field, value in metadata.items()):
+            posts[i] = dict(post, **metadata)
+            stale.append(post['id'])
+    if stale:
+        save_posts(posts)
+    print(f'Updated derived fields on {len(stale)} of {len(posts)} posts')
+    comments = load_comments()
+    stale = [i for i, c in enumerate(comments) if 'content_html' not in c or
+             c.get('content_hash') != content_hash(c.get('content', ''))]
+    for i in stale:
+        comments[i] = dict(comments[i], **rendered_content(comments[i].get('content', '')))
+    if stale:
+        save_comments(comments)
+    print(f'Updated rendered HTML on {len(stale)} of {len(comments)} comments')
+
+@app.cli.command('export-static')
+@click.option('--output', default=EXPORT_DIR, help='Directory to write the pages to.')
+@click.option('--workers', default=EXPORT_WORKERS, help='Number of processes rendering pages.')
+@click.option('--full', is_flag=True, help='Re-render every page instead of only the changed ones.')
+def export_static_command(output, workers, full):
+    """Render the public pages and JSON endpoints to static files"""
+    rendered, removed, total = export_static(output, workers, full)
+    print(f'Rendered {rendered} of {total} pages into {output}, removed {removed}')
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
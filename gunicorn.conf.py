@@ -0,0 +1,7 @@
+# Gunicorn settings, picked up automatically by `gunicorn app:app`
+
+
+def worker_exit(server, worker):
+    """Apply the view events and comments the worker queued before it exits"""
+    from app import drain_jobs
+    drain_jobs()
@@ -0,0 +1,35 @@
+import importlib
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_FILES = ('posts.json', 'users.json', 'comments.json', 'categories.json')
+
+
+@pytest.fixture
+def blog(tmp_path, monkeypatch):
+    """A fresh import of the app working on a copy of the data files"""
+    for name in DATA_FILES:
+        shutil.copy(os.path.join(ROOT, name), tmp_path / name)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(ROOT)
+    for name in ('BLOG_STORAGE', 'BLOG_DATA_FORMAT', 'BLOG_QUEUE_DB'):
+        monkeypatch.delenv(name, raising=False)
+    sys.modules.pop('app', None)
+    module = importlib.import_module('app')
+    yield module
+    sys.modules.pop('app', None)
+
+
+@pytest.fixture
+def make_post(blog):
+    """Store a post with the given title and content, returning its id"""
+    def make(title, content, **fields):
+        post = {'title': title, 'content': content, 'category': 'technology', 'tags': [],
+                'author_id': 1, 'date': '2024-01-01 10:00:00', 'updated_at': '2024-01-01 10:00:00'}
+        post.update(fields)
+        return blog.insert_post(post)
+    return make
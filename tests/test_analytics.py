@@ -0,0 +1,32 @@
+import json
+import os
+from datetime import date, timedelta
+
+TODAY = date(2024, 6, 30)
+
+
+def days_ago(n):
+    return (TODAY - timedelta(days=n)).isoformat()
+
+
+def test_view_flushes_only_rewrite_the_views_file(blog):
+    blog.record_views({(1, days_ago(40)): 3, (1, days_ago(1)): 2})
+    assert blog.rollup_views(TODAY) == 1
+    history = os.stat(blog.ANALYTICS_FILE).st_mtime_ns
+    blog.record_views({(1, days_ago(0)): 1})
+    assert os.stat(blog.ANALYTICS_FILE).st_mtime_ns == history
+    assert blog.get_view_total(1) == 6
+    assert blog.get_view_history(1) == [(blog._week_start(days_ago(40)), 'week', 3),
+                                        (days_ago(1), 'day', 2), (days_ago(0), 'day', 1)]
+    assert blog.get_view_history(1, start=days_ago(1), end=days_ago(1)) == [(days_ago(1), 'day', 2)]
+
+
+def test_legacy_analytics_file_is_split(blog):
+    legacy = {'post_views': {'1': {'total': 5, 'daily': {days_ago(1): 5},
+                                   'weekly': {'2024-01-01': 7}}}}
+    with open(blog.ANALYTICS_FILE, 'w') as f:
+        json.dump(legacy, f)
+    blog.init_analytics()
+    assert blog.get_view_total(1) == 5
+    assert blog.peek_data(blog.ANALYTICS_FILE) == {'post_views': {'1': {'weekly': {'2024-01-01': 7}}}}
+    assert blog.get_view_history(1) == [('2024-01-01', 'week', 7), (days_ago(1), 'day', 5)]
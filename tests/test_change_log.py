@@ -0,0 +1,41 @@
+import os
+
+
+def reload_from_disk(blog, filename):
+    """Read a file the way a freshly started process would"""
+    with blog._data_lock:
+        blog._data_cache.clear()
+    return blog.load_data(filename)
+
+
+def test_log_replays_on_top_of_compacted_snapshot(blog, make_post):
+    first = make_post('First', 'one')
+    second = make_post('Second', 'two')
+    blog.compact_log(blog.POSTS_FILE)
+    assert not os.path.exists(blog._log_name(blog.POSTS_FILE))
+
+    third = make_post('Third', 'three')
+    post = blog.get_post(first)
+    post['title'] = 'First, edited'
+    blog.update_post(post)
+    blog._delete_records('posts', [second])
+    assert os.path.exists(blog._log_name(blog.POSTS_FILE))
+
+    expected = blog.load_data(blog.POSTS_FILE)
+    assert reload_from_disk(blog, blog.POSTS_FILE) == expected
+    by_id = {p['id']: p for p in expected}
+    assert by_id[first]['title'] == 'First, edited'
+    assert second not in by_id and third in by_id
+
+
+def test_automatic_compaction_keeps_later_changes(blog, make_post, monkeypatch):
+    monkeypatch.setattr(blog, 'LOG_COMPACT_ENTRIES', 3)
+    ids = [make_post(f'Post {i}', f'body {i}') for i in range(5)]
+
+    # The third insert folded the log into the snapshot; the last two are
+    # only in the new log
+    with open(blog._log_name(blog.POSTS_FILE)) as f:
+        assert len(f.readlines()) == 2
+    stored = reload_from_disk(blog, blog.POSTS_FILE)
+    assert [p['id'] for p in stored][-5:] == ids
+    assert stored == blog.load_data(blog.POSTS_FILE)
@@ -0,0 +1,58 @@
+import json
+import os
+import struct
+
+import pytest
+
+RECORDS = [
+    {'id': 1, 'title': 'Café', 'tags': ['a', 'b'], 'score': 1.5, 'draft': False,
+     'author_id': None, 'meta': {'nested': [1, {'deep': True}]}, 'big': 2 ** 70},
+    {'id': 2, 'title': '', 'tags': [], 'score': -3, 'draft': True},
+]
+
+
+@pytest.mark.parametrize('data_format', ['json', 'compact', 'jsonl', 'binary'])
+def test_formats_round_trip(blog, data_format):
+    blog._write_snapshot('records.json', RECORDS, data_format)
+    assert blog._read_snapshot('records.json') == RECORDS
+    analytics = {'post_views': {'1': {'total': 3, 'daily': {'2024-01-01': 3}}}}
+    blog._write_snapshot('analytics.json', analytics, data_format)
+    assert blog._read_snapshot('analytics.json') == analytics
+
+
+def test_binary_records_follow_the_offset_table(blog):
+    blog._write_snapshot('records.json', RECORDS, 'binary')
+    with open('records.json', 'rb') as f:
+        data = f.read()
+    magic, kind, count = blog._BINARY_HEADER.unpack_from(data, 0)
+    assert (magic, kind, count) == (b'BLOGBIN3', b'L', 2)
+    (second,) = blog._BINARY_OFFSET.unpack_from(data, blog._BINARY_HEADER.size + blog._BINARY_OFFSET.size)
+    assert blog._decode_value(data, second)[0] == RECORDS[1]
+
+
+def test_framed_binary_files_still_load(blog):
+    blobs = [json.dumps(record).encode() for record in RECORDS]
+    with open('records.json', 'wb') as f:
+        f.write(blog._BINARY_HEADER.pack(b'BLOGBIN1', b'L', len(blobs)))
+        offset = blog._BINARY_HEADER.size + 8 * len(blobs)
+        for blob in blobs:
+            f.write(struct.pack('<Q', offset))
+            offset += 4 + len(blob)
+        for blob in blobs:
+            f.write(struct.pack('<I', len(blob)) + blob)
+    assert blog._read_snapshot('records.json') == RECORDS
+
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='bodies are decoded when read on Windows')
+def test_binary_post_bodies_are_read_on_demand(blog, make_post):
+    post_id = make_post('Lazy', 'Body text é')
+    blog.compact_log(blog.POSTS_FILE, 'binary')
+    blog._data_cache.clear()
+    cached = next(p for p in blog.peek_data(blog.POSTS_FILE) if p['id'] == post_id)
+    assert isinstance(cached['content'], blog._StoredText)
+    assert blog.get_post(post_id)['content'] == 'Body text é'
+    assert blog.get_post_bodies([post_id]) == {post_id: 'Body text é'}
+    blog.compact_log(blog.POSTS_FILE, 'json')
+    blog._data_cache.clear()
+    assert blog.get_post(post_id)['content'] == 'Body text é'
@@ -0,0 +1,65 @@
+import json
+
+
+def queue_comment(blog, post_id, content, submission_id):
+    comment = {'post_id': post_id, 'author_id': 1, 'content': content,
+               'date': '2024-01-02 10:00:00', 'submission_id': submission_id}
+    blog.enqueue_job('comment', comment)
+    return comment
+
+
+def test_replayed_comment_job_is_skipped(blog, make_post):
+    post_id = make_post('Jobs', 'body')
+    comment = queue_comment(blog, post_id, 'hello', 'abc123')
+    blog.drain_jobs()
+    assert [c['content'] for c in blog.get_post_comments(post_id)] == ['hello']
+
+    # A worker that stored the comment but died before deleting the job
+    # leaves it queued; running it again must not add a second copy
+    blog.enqueue_job('comment', comment)
+    blog.drain_jobs()
+    assert [c['submission_id'] for c in blog.get_post_comments(post_id)] == ['abc123']
+    assert not blog._job_db().execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+
+
+def test_duplicate_comment_jobs_in_one_batch(blog, make_post):
+    post_id = make_post('Jobs', 'body')
+    queue_comment(blog, post_id, 'first', 'same')
+    queue_comment(blog, post_id, 'first', 'same')
+    queue_comment(blog, post_id, 'second', 'other')
+    blog.drain_jobs()
+    assert [c['content'] for c in blog.get_post_comments(post_id)] == ['first', 'second']
+
+
+def test_orphaned_jobs_are_adopted_after_lease_expires(blog, make_post, monkeypatch):
+    post_id = make_post('Jobs', 'body')
+    db = blog._job_db()
+    payload = json.dumps({'post_id': post_id, 'author_id': 1, 'content': 'orphan',
+                          'date': '2024-01-02 10:00:00', 'submission_id': 'dead'})
+    db.execute('INSERT INTO jobs (kind, origin, owner, payload) VALUES (?, ?, ?, ?)',
+               ('comment', 'gone:1', 'gone:1', payload))
+    blog._renew_job_lease(db, 'gone:1')
+    blog.drain_jobs()
+    assert blog.get_post_comments(post_id) == []
+
+    monkeypatch.setattr(blog, 'JOB_LEASE_SECONDS', -1)
+    blog.drain_jobs()
+    assert [c['content'] for c in blog.get_post_comments(post_id)] == ['orphan']
+
+
+def test_lease_is_renewed_for_every_batch(blog, make_post, monkeypatch):
+    post_id = make_post('Jobs', 'body')
+    for i in range(3):
+        queue_comment(blog, post_id, f'comment {i}', f'id-{i}')
+    renewals = []
+    renew = blog._renew_job_lease
+    monkeypatch.setattr(blog, 'JOB_BATCH_SIZE', 1)
+    monkeypatch.setattr(blog, '_renew_job_lease', lambda db, token: renewals.append(token) or renew(db, token))
+    blog.drain_jobs()
+    assert len(blog.get_post_comments(post_id)) == 3
+    assert len(renewals) >= 3
+
+
+def test_exit_hook_leaves_unused_queue_alone(blog, tmp_path):
+    blog._drain_jobs_at_exit()
+    assert not (tmp_path / blog.JOB_QUEUE_DB).exists()
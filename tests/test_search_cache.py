@@ -0,0 +1,31 @@
+import pytest
+
+
+@pytest.fixture
+def posts(make_post):
+    make_post('Python tips', 'learn python web frameworks fast')
+    make_post('Pythonic code', 'python idioms and the python data model')
+    make_post('Web basics', 'html css and a little python for the web')
+    make_post('Pytest guide', 'fixtures make testing web apps simple')
+    make_post('Rust notes', 'ownership and borrowing')
+
+
+@pytest.mark.parametrize('mode', ['basic', 'bm25'])
+def test_prefix_reuse_matches_uncached_scores(blog, posts, mode, monkeypatch):
+    reused = []
+    score_query = blog._score_query
+
+    def recording_score_query(query_terms, mode, candidates=None):
+        reused.append(candidates is not None)
+        return score_query(query_terms, mode, candidates)
+
+    monkeypatch.setattr(blog, '_score_query', recording_score_query)
+    queries = ['py', 'pyt', 'pyth', 'python', 'python w', 'python web']
+    for query in queries:
+        blog.search_post_ids(query, mode)
+    assert reused == [False] + [True] * (len(queries) - 1)
+
+    for query in queries:
+        cached = blog.search_post_ids(query, mode)
+        assert cached == score_query(blog.tokenize(query), mode)
+    assert blog.search_post_ids('python web', mode)